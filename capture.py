@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ctypes
+import socket
+import struct
+import time
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+PACKET_OUTGOING = 4
+
+# смещения полей в кадре Ethernet с IPv4
+ETH_TYPE_OFFSET = 12
+IP_OFFSET = 14
+IP_SRC_OFFSET = IP_OFFSET + 12
+
+# кадр обрезается ядром до заголовков и префикса полезной нагрузки
+CAPTURE_SNAPLEN = 128
+# размер приемного буфера сокета
+CAPTURE_RCVBUF = 2 ** 24
+# период проверки условий остановки захвата
+CAPTURE_POLL = 0.1
+
+# коды инструкций классического BPF
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_ALU_AND_K = 0x54
+BPF_JMP_JEQ_K = 0x15
+BPF_RET_K = 0x06
+# вспомогательные данные: тип пакета (SKF_AD_OFF + SKF_AD_PKTTYPE)
+SKF_AD_PKTTYPE = 0xfffff000 + 4
+BPF_MAXINSNS = 4096
+
+BPF_INSN = struct.Struct('HBBI')
+
+
+def bpf_mask(mask):
+    """
+    >>> bpf_mask(24) == 0xffffff00
+    True
+    """
+
+    return (0xffffffff << (32 - mask)) & 0xffffffff
+
+
+def address_filter(prefixes, snaplen=CAPTURE_SNAPLEN):
+    """
+    программа BPF, пропускающая входящие кадры IPv4 с адресом источника
+    из заданных сетей prefixes = [(адрес, длина маски)]
+    все переходы короткие, поэтому длина программы ограничена только BPF_MAXINSNS
+    >>> len(address_filter([(0x0a000000, 8), (0x80000100, 24)]))
+    15
+    """
+
+    program = [
+        # исходящие кадры того же интерфейса не нужны
+        (BPF_LD_B_ABS, 0, 0, SKF_AD_PKTTYPE),
+        (BPF_JMP_JEQ_K, 0, 1, PACKET_OUTGOING),
+        (BPF_RET_K, 0, 0, 0),
+        (BPF_LD_H_ABS, 0, 0, ETH_TYPE_OFFSET),
+        (BPF_JMP_JEQ_K, 1, 0, ETH_P_IP),
+        (BPF_RET_K, 0, 0, 0),
+    ]
+    for addr, mask in prefixes:
+        program += [
+            (BPF_LD_W_ABS, 0, 0, IP_SRC_OFFSET),
+            (BPF_ALU_AND_K, 0, 0, bpf_mask(mask)),
+            (BPF_JMP_JEQ_K, 0, 1, addr & bpf_mask(mask)),
+            (BPF_RET_K, 0, 0, snaplen),
+        ]
+    program.append((BPF_RET_K, 0, 0, 0))
+    if len(program) > BPF_MAXINSNS:
+        raise ValueError('Too many nets for capture filter: {0}'.format(len(prefixes)))
+    return program
+
+
+def attach_filter(sock, program):
+    """
+    подключение программы BPF к сокету (SO_ATTACH_FILTER)
+    """
+
+    code = ctypes.create_string_buffer(''.join(BPF_INSN.pack(*insn) for insn in program))
+    # struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+    fprog = struct.pack('HL', len(program), ctypes.addressof(code))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+# =============================================================================
+
+
+class Capture(object):
+    """
+    захват кадров на интерфейсе без разбора scapy: отбор кадров выполняет
+    программа BPF в ядре, кадры читаются в заранее выделенный буфер
+    prefixes - сети, пакеты от которых нужно захватывать (см. Translator.prefixes);
+               None - все входящие кадры IPv4
+    """
+
+    def __init__(self, iface, prefixes=None, snaplen=CAPTURE_SNAPLEN, rcvbuf=CAPTURE_RCVBUF):
+        self.iface = iface
+        # сокет без протокола ничего не принимает до bind,
+        # поэтому в нем не окажется кадров, не прошедших фильтр
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        attach_filter(self.sock, address_filter([(0, 0)] if prefixes is None else prefixes, snaplen))
+        self.sock.bind((iface, ETH_P_ALL))
+        self.buffer = bytearray(snaplen)
+        self.view = memoryview(self.buffer)
+        self.limit = 0
+        self.deadline = 0
+
+    def stop_after(self, count, timeout):
+        """
+        условия остановки захвата: count кадров или timeout секунд от текущего момента
+        может вызываться из другого потока во время захвата, например,
+        когда количество отправленных пакетов становится известно
+        """
+
+        self.limit = count
+        self.deadline = time.time() + timeout
+
+    def capture(self, count, timeout, on_frame=None):
+        """
+        прием не более count кадров, но не дольше timeout секунд (см. stop_after)
+        on_frame(время, кадр) вызывается для каждого кадра; кадр - memoryview,
+        действительный только во время вызова
+        возвращает количество принятых кадров
+        """
+
+        self.stop_after(count, timeout)
+        return self.run(on_frame)
+
+    def run(self, on_frame=None):
+        """
+        прием кадров до выполнения условий остановки, заданных stop_after
+        """
+
+        received = 0
+        while received < self.limit:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                break
+            self.sock.settimeout(min(remaining, CAPTURE_POLL))
+            try:
+                length = self.sock.recv_into(self.buffer)
+            except socket.timeout:
+                continue
+            received += 1
+            if on_frame is not None:
+                on_frame(time.time(), self.view[:length])
+        return received
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# интерфейсы, через которые отправляются пакеты каждой стороны сети
+send_ifaces = {'l': 'eth1', 'r': 'eth0'}
+# интерфейсы, на которых принимаются пакеты, отправленные каждой стороной
+capture_ifaces = {'l': 'eth0', 'r': 'eth1'}
+
+# MAC-адрес назначения кадров (коммутатор под тестом принимает широковещательные кадры)
+dst_mac = 'ff:ff:ff:ff:ff:ff'
+# количество кадров, отправляемых одним системным вызовом
+transmit_batch = 256
+# множитель интервалов между пакетами при воспроизведении по меткам времени
+time_scale = 1.0
+
+# наибольшая длительность захвата при оценке по потерям, с
+capture_timeout = 60.0
+# время ожидания опоздавших пакетов после окончания отправки, с
+capture_grace = 1.0
+# веса составляющих оценки по потерям (см. matcher.MatchStats)
+fitness_weights = {'loss': 100.0, 'reordering': 10.0, 'duplication': 10.0, 'latency': 1.0}
+
+# параллельная оценка популяции в пуле процессов (см. parallel)
+parallel_evaluation = False
+# количество рабочих процессов, None - по количеству ядер
+eval_processes = None
+# пары интерфейсов (отправка, захват) для рабочих процессов: одна пара - общий коммутатор,
+# доступ к которому сериализуется, пара на процесс (например, VLAN) - независимые тесты
+worker_ifaces = [(send_ifaces, capture_ifaces)]
+# наибольшее количество пакетов, генерируемых рабочим процессом до занятия устройства:
+# остальные пакеты генерируются потоково во время отправки (около 1.5 КБ памяти на пакет)
+prefetch_frames = 100000
+# размер популяции и количество поколений
+population_size = 4
+generations = 10
+# кроссовер потоков: 'one_point', 'two_point' или 'uniform' (см. genetic_engine.crossover_swaps)
+crossover = 'one_point'
+# смешивание точек ФРВ родителей при кроссовере (см. FX.blend)
+crossover_blend = False
+# отбор потомков по суррогатной модели (см. surrogate): на оборудовании оцениваются только
+# surrogate_top_k лучших по прогнозу особей поколения (0 - отбор отключен); модель обучается
+# на реальных оценках и применяется после surrogate_min_samples оценок
+surrogate_top_k = 0
+surrogate_min_samples = 8
+surrogate_ridge = 1.0
+# модель островов (см. islands): количество популяций в отдельных процессах (1 - одна популяция),
+# топология миграции ('ring' или 'full'), интервал миграции в поколениях и количество мигрантов
+islands = 1
+island_topology = 'ring'
+migration_interval = 5
+migration_size = 1
+
+# кэш оценок геномов (см. fitness_cache): наибольшее количество записей (0 - без кэша),
+# время жизни записи в секундах (None - без ограничения) и файл для сохранения между запусками
+fitness_cache_size = 1024
+fitness_cache_ttl = None
+fitness_cache_path = None
+# количество новых записей, после которого кэш сохраняется в файл (сохранение переписывает весь файл)
+fitness_cache_save_every = 256
+
+# отладочный режим: полная проверка каждой копии особи (см. NetworkGenome.clone)
+validate_clones = False
+
+# зерно генераторов случайных чисел прогона, None - случайный прогон
+seed = None
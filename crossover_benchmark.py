@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+замер времени кроссовера в зависимости от количества потоков:
+при линейной трансляции узлов и сетей время на поток не растет
+запуск: python crossover_benchmark.py [количество потоков ...]
+"""
+
+import random
+import sys
+import timeit
+
+from flow import random_flow
+from genetic_engine import NetworkGenome, network_crossover
+from fx import FFlow
+from nets_manager import masks, directions
+
+
+def big_genome(flows_count, rng):
+    """
+    геном с flows_count потоками между flows_count узлами
+    """
+
+    nets = [(rng.choice(masks), rng.choice(directions)) for i in xrange(10)]
+    nodes = [rng.randint(0, len(nets) - 1) for i in xrange(flows_count)]
+    flows = [random_flow(rng.randint(0, flows_count - 1), rng.randint(0, flows_count - 1), rng)
+             for i in xrange(flows_count)]
+    return NetworkGenome(nets, nodes, flows, FFlow().random_initialize(rng), 42.0, rng.randint(0, 2 ** 32 - 1))
+
+
+def main(sizes):
+    rng = random.Random(1)
+    print '{0:>8} {1:>12} {2:>14}'.format('flows', 'crossover, s', 'per flow, us')
+    for size in sizes:
+        mom = big_genome(size, rng)
+        dad = big_genome(size, rng)
+        repeat = max(1, 2000 / size)
+        elapsed = timeit.timeit(lambda: network_crossover(None, mom=mom, dad=dad), number=repeat) / repeat
+        print '{0:>8} {1:>12.6f} {2:>14.2f}'.format(size, elapsed, elapsed / size * 1e6)
+
+
+if __name__ == '__main__':
+    main(map(int, sys.argv[1:]) or [10, 100, 1000, 3000])
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import cPickle
+import os
+import time
+from collections import OrderedDict
+
+import config
+
+
+class FitnessCache(object):
+    """
+    кэш оценок геномов по хэшу содержимого (см. NetworkGenome.content_hash)
+    вытесняются давно не использованные записи (LRU) и записи старше ttl
+    capacity - наибольшее количество записей
+    ttl      - время жизни записи в секундах, None - без ограничения
+    path     - файл, в котором кэш сохраняется между запусками, None - только в памяти
+    save_every - количество новых записей, после которого кэш сохраняется в файл;
+               остальные записи сохраняются flush (после поколения и в конце прогона)
+    >>> cache = FitnessCache(2)
+    >>> cache.put('a', 1.0); cache.put('b', 2.0)
+    >>> cache.get('a')
+    1.0
+    >>> cache.put('c', 3.0)
+    >>> cache.get('b') is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    def __init__(self, capacity, ttl=None, path=None, clock=time.time, save_every=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every or config.fitness_cache_save_every
+        # количество записей, не сохраненных в файл
+        self.unsaved = 0
+        self.clock = clock
+        # хэш -> (оценка, время записи), порядок - от давно использованных к недавним
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        оценка по ключу, None если ее нет в кэше или она устарела
+        """
+
+        entry = self.entries.pop(key, None)
+        if entry is None or (self.ttl is not None and self.clock() - entry[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, score):
+        if self.capacity <= 0:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = (score, self.clock())
+        self.trim()
+        self.unsaved += 1
+        if self.path is not None and self.unsaved >= self.save_every:
+            self.save()
+
+    def merge(self, entries):
+        """
+        добавление записей другого кэша (например, кэша процесса острова),
+        entries - пары (хэш, (оценка, время записи)); из двух записей одного
+        генома остается более поздняя
+        """
+
+        for key, entry in entries:
+            current = self.entries.get(key)
+            if current is None or current[1] < entry[1]:
+                self.entries.pop(key, None)
+                self.entries[key] = entry
+                self.unsaved += 1
+        self.trim()
+
+    def trim(self):
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def evaluate(self, genome, evaluator):
+        """
+        оценка генома через кэш: evaluator вызывается только при промахе
+        """
+
+        key = genome.content_hash()
+        score = self.get(key)
+        if score is None:
+            score = evaluator(genome)
+            self.put(key, score)
+        return score
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return float(self.hits) / requests if requests else 0.0
+
+    def stats(self):
+        return 'entries: {0}, hits: {1}, misses: {2}, hit rate: {3:.2%}'.format(len(self), self.hits, self.misses,
+                                                                              self.hit_rate)
+
+    def save(self):
+        """
+        запись кэша в файл через временный файл, чтобы прерванная запись
+        не испортила сохраненный ранее кэш
+        """
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump(self.entries.items(), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+        self.unsaved = 0
+
+    def flush(self):
+        """
+        сохранение записей, добавленных после последней записи в файл
+        """
+
+        if self.path is not None and self.unsaved:
+            self.save()
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            self.entries = OrderedDict(cPickle.load(f))
+        self.trim()
+
+
+# кэш оценок процесса, общий для всех особей
+fitness_cache = FitnessCache(config.fitness_cache_size, config.fitness_cache_ttl, config.fitness_cache_path)
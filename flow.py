@@ -1,11 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import uuid
+from socket import inet_aton
+
+import numpy
 
 from fx import *
+from raw_packets import TCPTemplate, UDPTemplate, ICMPTemplate, PayloadPool
+from schedule import build_schedule
 from scapy.all import *
 from scapy.layers.inet import TCP, IP, UDP, ICMP
 
+# общий для всех потоков пул полезной нагрузки
+payload_pool = PayloadPool()
+# наибольшее зерно генератора случайных чисел потока (ограничение RandomState)
+MAX_SEED = 2 ** 32 - 1
+# наименьший средний интервал между пакетами при оценке их количества, с
+MIN_INTERVAL = 1e-6
+# пакеты открытия (SYN, SYN+ACK, ACK) и закрытия (FIN+ACK с обеих сторон) соединения TCP
+TCP_OPEN_PACKETS = 3
+TCP_CLOSE_PACKETS = 2
+
 
 class Flow(object):
     """
@@ -41,6 +55,13 @@ class Flow(object):
         # массив ссылок на все ФРВ
         self.fxs = params[2:]
 
+        # зерно генератора потока: пока поток не изменился, его план
+        # пакетов воспроизводится и не строится заново (см. plan);
+        # random_flow берет зерно из генератора генома (см. seed)
+        self.__seed = None
+        # кэш плана пакетов (t0, план), None - поток изменен после построения плана
+        self.cached_plan = None
+
     def __repr__(self):
         return
         """{0}, {1}, {2}, {3}""".format(self.node1, str(self.ftp1), str(self.flp1), str(self.fttl1))
@@ -48,18 +69,161 @@ class Flow(object):
         + """{0}, {1}""".format(str(self.ftf), str(self.fhf))
     # -------------------------------------------------------------------------
 
+    def canonical(self):
+        """
+        каноническое представление потока для хэширования (см. NetworkGenome.content_hash)
+        """
+
+        return (type(self).__name__, self.node1, self.node2, self.seed) + tuple(fx.canonical() for fx in self.fxs)
+
+    @property
+    def seed(self):
+        """
+        зерно генератора потока; зерно назначают random_flow и PopulationStore,
+        поэтому модуль random используется только для потока, созданного
+        конструктором без назначения зерна, и только при первом обращении
+        """
+
+        if self.__seed is None:
+            self.__seed = random.randint(0, MAX_SEED)
+        return self.__seed
+
+    @seed.setter
+    def seed(self, seed):
+        self.__seed = seed
+
+    @property
+    def dirty(self):
+        return self.cached_plan is None
+
+    def mark_dirty(self):
+        """
+        отметка об изменении потока: план пакетов будет построен заново
+        вызывается при каждом изменении ФРВ потока
+        """
+
+        self.cached_plan = None
+
+    def plan(self, t0):
+        """
+        план пакетов потока, построенный генератором с зерном потока
+        и закэшированный до следующего изменения потока
+        """
+
+        if self.cached_plan is None or self.cached_plan[0] != t0:
+            self.cached_plan = (t0, self.build_plan(t0))
+        return self.cached_plan[1]
+
+    def build_plan(self, t0):
+        """
+        построение плана пакетов: по умолчанию - векторное расписание
+        """
+
+        return self.schedule(t0, numpy.random.RandomState(self.seed))
+
+    def __getstate__(self):
+        """
+        план при передаче в другой процесс не сериализуется, он строится
+        заново по зерну потока
+        """
+
+        state = self.__dict__.copy()
+        state['cached_plan'] = None
+        return state
+
     def generate(self, translator, t0):
         """
         функция генерации
         translator - транслятор индексов узлов в сетевые адреса
         t0         - время начала потока
+        возвращает генератор пакетов в порядке времени
         """
 
-        return []
+        return iter([])
+
+    def generate_raw(self, translator, t0):
+        """
+        быстрая генерация пакетов в байтах, минуя scapy
+        возвращает кортежи (время, направление, пакет), где пакет - memoryview,
+        действительный до следующей итерации
+        """
+
+        return iter([])
+
+    def schedule(self, t0, rng=None):
+        """
+        первая фаза генерации: векторное расписание пакетов потока
+        (времена, направления, длины, ttl) без построения объектов scapy
+        t0  - время начала потока
+        rng - генератор numpy (RandomState)
+        """
+
+        t1 = t0 + float(self.ftf.sample(1, rng)[0])
+        return build_schedule(t0, t1, self.fhf, (self.ftp1, self.ftp2), (self.flp1, self.flp2),
+                              (self.fttl1, self.fttl2), rng)
+
+    def materialize(self, translator, schedule):
+        """
+        вторая фаза генерации: построение пакетов по расписанию (генератор)
+        """
+
+        return iter([])
+
+    # -------------------------------------------------------------------------
+
+    def direction_split(self):
+        """
+        доли пакетов направлений (0 - от node1 к node2, 1 - обратно):
+        значения FHF - 0 или 1, поэтому доля направления 1 равна среднему FHF
+        """
+
+        right = self.fhf.mean()
+        return 1.0 - right, right
+
+    def expected_interval(self):
+        """
+        средний интервал между пакетами: после пакета интервал берется из ФРВ его направления
+        """
+
+        left, right = self.direction_split()
+        return left * self.ftp1.mean() + right * self.ftp2.mean()
+
+    def expected_packets(self):
+        """
+        ожидаемое количество пакетов без их генерации: первый пакет в момент
+        начала потока и по одному на каждый средний интервал за время его жизни
+        >>> ftp = FTP([[1.0, 0.01]])
+        >>> flp = FLP([[1.0, 200]])
+        >>> fttl = FTTL([[1.0, 1]])
+        >>> f = Flow(0, 1, ftp, flp, fttl, ftp, flp, fttl, FTF([[1.0, 10]]), FHF([[0.5, 0], [1.0, 1]]))
+        >>> round(f.expected_packets())
+        1001.0
+        >>> [round(n, 1) for n in f.expected_direction_packets()]
+        [500.5, 500.5]
+        """
+
+        return self.ftf.mean() / max(self.expected_interval(), MIN_INTERVAL) + 1
+
+    def expected_direction_packets(self):
+        """
+        ожидаемое количество пакетов каждого направления
+        """
+
+        packets = self.expected_packets()
+        left, right = self.direction_split()
+        return packets * left, packets * right
+
+    def expected_bytes(self):
+        """
+        ожидаемый объем полезной нагрузки (с префиксом пула, см. PayloadPool.size)
+        """
+
+        left, right = self.expected_direction_packets()
+        return left * payload_pool.size(self.flp1.mean()) + right * payload_pool.size(self.flp2.mean())
 
     @staticmethod
     def generate_l5(length):
-        l5 = str(uuid.uuid1()) + 'A' * length
+        l5 = payload_pool.string(length)
         return l5
 
     def copy(self, g):
@@ -83,24 +247,43 @@ class Flow(object):
         # массив ссылок на все ФРВ
         g.fxs = [g.ftp1, g.flp1, g.fttl1, g.ftp2, g.flp2, g.fttl2, g.ftf, g.fhf]
 
+        # копия до первого изменения использует план оригинала
+        g.seed = self.seed
+        g.cached_plan = self.cached_plan
+
     def clone(self):
-        clone = Flow(self.node1, self.node2, self.ftp1, self.flp1, self.fttl1, self.ftp2, self.flp2, self.fttl2,
-                     self.ftf, self.fhf)
+        """
+        копия потока без конструктора: поля оригинала уже проверены,
+        все они заполняются методом copy соответствующего класса
+        """
+        clone = type(self).__new__(type(self))
         self.copy(clone)
         return clone
 
-    def random_initialize(self, node1, node2):
+    def blend(self, other, rng=None):
+        """
+        попарное смешивание ФРВ двух потоков (см. FX.blend), изменяются оба потока
+        """
+
+        for fx1, fx2 in zip(self.fxs, other.fxs):
+            fx1.blend(fx2, rng)
+        self.mark_dirty()
+        other.mark_dirty()
 
-        self.ftp1 = FTP().random_initialize()
-        self.flp1 = FLP().random_initialize()
-        self.fttl1 = FTTL().random_initialize()
+    def random_initialize(self, node1, node2, rng=None):
 
-        self.ftp2 = FTP().random_initialize()
-        self.flp2 = FLP().random_initialize()
-        self.fttl2 = FTTL().random_initialize()
+        self.ftp1 = FTP().random_initialize(rng)
+        self.flp1 = FLP().random_initialize(rng)
+        self.fttl1 = FTTL().random_initialize(rng)
 
-        self.ftf = FTF().random_initialize()
-        self.fhf = FHF().random_initialize()
+        self.ftp2 = FTP().random_initialize(rng)
+        self.flp2 = FLP().random_initialize(rng)
+        self.fttl2 = FTTL().random_initialize(rng)
+
+        self.ftf = FTF().random_initialize(rng)
+        self.fhf = FHF().random_initialize(rng)
+        self.fxs = [self.ftp1, self.flp1, self.fttl1, self.ftp2, self.flp2, self.fttl2, self.ftf, self.fhf]
+        self.mark_dirty()
 
 
 # =============================================================================
@@ -128,6 +311,9 @@ class FlowSock(Flow):
     def __repr__(self):
         return """port1:{0}, port2:{1}""".format(self.port1, self.port1)
 
+    def canonical(self):
+        return super(FlowSock, self).canonical() + (self.port1, self.port2)
+
     def copy(self, g):
         if not isinstance(g, FlowSock):
             raise ValueError("Expected FlowSock, got: {0}".format(type(g)))
@@ -137,29 +323,25 @@ class FlowSock(Flow):
         g.port2 = self.port2
         return
 
-    def clone(self):
-        clone = type(self)(self.port1, self.port2, self.node1, self.node2, self.ftp1, self.flp1, self.fttl1, self.ftp2,
-                           self.flp2, self.fttl2, self.ftf, self.fhf)
-        self.copy(clone)
-        return clone
-
     @staticmethod
-    def random_port():
-        return random.randint(0, 2 ** 16 - 1)
+    def random_port(rng=None):
+        return (rng or random).randint(0, 2 ** 16 - 1)
 
-    def mutation(self):
-        mutation_index = random.randint(0, len(self.fxs) + 1)
+    def mutation(self, rng=None):
+        rng = rng or random
+        mutation_index = rng.randint(0, len(self.fxs) + 1)
         if mutation_index == len(self.fxs):  # мутирует порт1
-            self.port1 = self.random_port()
-        if mutation_index > len(self.fxs):  # мутирует порт2
-            self.port2 = self.random_port()
+            self.port1 = self.random_port(rng)
+        elif mutation_index > len(self.fxs):  # мутирует порт2
+            self.port2 = self.random_port(rng)
         else:
-            self.fxs[mutation_index].mutation()
+            self.fxs[mutation_index].mutation(rng)
+        self.mark_dirty()
 
-    def random_initialize(self, node1, node2):
-        Flow.random_initialize(self, node1, node2)
-        self.port1 = self.random_port()
-        self.port2 = self.random_port()
+    def random_initialize(self, node1, node2, rng=None):
+        Flow.random_initialize(self, node1, node2, rng)
+        self.port1 = self.random_port(rng)
+        self.port2 = self.random_port(rng)
 
 
 # =============================================================================
@@ -177,7 +359,7 @@ class FlowTCP(FlowSock):
     >>> nets  = [('a', 'l'), ('b', 'r')]
     >>> nodes = [0, 1]
     >>> t     = Translator(nets, nodes)
-    >>> packs = f.generate(t, 42.0)
+    >>> packs = list(f.generate(t, 42.0))
     >>> 950 < len(packs) < 1050
     True
     >>> (packs[0][TCP].sport, packs[1][TCP].sport, packs[2][TCP].sport)
@@ -192,8 +374,6 @@ class FlowTCP(FlowSock):
 
     def generate(self, translator, t0):
 
-        t1 = t0 + self.ftf.random()
-
         ip1 = translator.node2ip[self.node1]
         ip2 = translator.node2ip[self.node2]
 
@@ -202,17 +382,83 @@ class FlowTCP(FlowSock):
         l3_2 = IP(src=ip2, dst=ip1)
         l4_2 = TCP(sport=self.port2, dport=self.port1)
 
-        l34_1 = l3_1 / l4_1
-        l34_2 = l3_2 / l4_2
+        l34s = (l3_1 / l4_1, l3_2 / l4_2)
+
+        for t, direction, flags, seq, ack, ttl, length in self.plan(t0):
+            l34 = l34s[direction]
+            l34[TCP].flags = flags
+            l34[TCP].seq = seq
+            l34[TCP].ack = ack
+            l34[IP].ttl = ttl
+
+            p = l34 / (self.generate_l5(length) if length is not None else '')
+            p.time = t
+
+            yield p
+
+    def generate_raw(self, translator, t0):
+
+        ip1 = inet_aton(translator.node2ip[self.node1])
+        ip2 = inet_aton(translator.node2ip[self.node2])
+        templates = (TCPTemplate(ip1, ip2, self.port1, self.port2), TCPTemplate(ip2, ip1, self.port2, self.port1))
+        for t, direction, flags, seq, ack, ttl, length in self.plan(t0):
+            if length is None:
+                yield t, direction, templates[direction].build(seq, ack, flags, ttl)
+            else:
+                yield t, direction, templates[direction].build(seq, ack, flags, ttl, *payload_pool.take(length))
+
+    def direction_split(self):
+        """
+        направление сегмента данных TCP выбирается равновероятно, FHF не используется
+        """
+
+        return 0.5, 0.5
+
+    def expected_packets(self):
+        """
+        открытие соединения занимает первые интервалы жизни потока, сегменты
+        данных отправляются до ее окончания, затем соединение закрывается
+        """
+
+        interval = max(self.expected_interval(), MIN_INTERVAL)
+        data = max(self.ftf.mean() / interval - TCP_OPEN_PACKETS, 0) + 1
+        return TCP_OPEN_PACKETS + data + TCP_CLOSE_PACKETS
+
+    def expected_bytes(self):
+        """
+        нагрузку несут сегменты данных и закрытия, но не сегменты открытия
+        """
+
+        loaded = self.expected_packets() - TCP_OPEN_PACKETS
+        return loaded * (payload_pool.size(self.flp1.mean()) + payload_pool.size(self.flp2.mean())) / 2
+
+    def build_plan(self, t0):
+        """
+        план соединения TCP - список сегментов (см. segments)
+        """
+
+        return list(self.segments(t0, random.Random(self.seed)))
+
+    def segments(self, t0, rng=None):
+        """
+        конечный автомат соединения TCP, не зависящий от способа построения пакетов
+        t0  - время начала потока
+        rng - генератор (random.Random), по умолчанию модуль random
+        возвращает кортежи (время, направление, флаги, seq, ack, ttl, длина нагрузки);
+        у пакетов без нагрузки длина равна None
+        """
+
+        rng = rng or random
+        t1 = t0 + self.ftf.random(rng)
+
         params1 = {'ftp': self.ftp1, 'flp': self.flp1, 'fttl': self.fttl1}
         params2 = {'ftp': self.ftp2, 'flp': self.flp2, 'fttl': self.fttl2}
 
         seq_mod = 2 ** 32
         max_seq = 2 ** 32 - 1
-        seq1 = random.random() * max_seq
-        seq2 = random.random() * max_seq
+        seq1 = int(rng.random() * max_seq)
+        seq2 = int(rng.random() * max_seq)
 
-        packets = []
         t = t0
         state = 'C'
 
@@ -221,10 +467,9 @@ class FlowTCP(FlowSock):
             # открытие соединения
             if state == 'C':
 
-                l34 = l34_1
-                l5 = ''
-                flags_on = 2  # 2 - SYN, 4 - RST, 16 - ACK
-                flags_off = 1 | 4 | 16
+                direction = 0
+                length = None
+                flags = 2  # 1 - FIN, 2 - SYN, 4 - RST, 16 - ACK
                 params = params1
                 seq = seq1
                 ack = 0
@@ -233,10 +478,9 @@ class FlowTCP(FlowSock):
 
             elif state == 'O1':
 
-                l34 = l34_2
-                l5 = ''
-                flags_on = 2 | 16
-                flags_off = 1 | 4
+                direction = 1
+                length = None
+                flags = 2 | 16
                 seq = seq2
                 ack = seq1
                 params = params2
@@ -245,10 +489,9 @@ class FlowTCP(FlowSock):
 
             elif state == 'O2':
 
-                l34 = l34_1
-                l5 = ''
-                flags_on = 16
-                flags_off = 1 | 2 | 4
+                direction = 0
+                length = None
+                flags = 16
                 seq = seq1
                 ack = seq2
                 params = params1
@@ -257,67 +500,53 @@ class FlowTCP(FlowSock):
             # передача данных
             elif state == 'E':
 
-                flags_on = 16
-                flags_off = 1 | 2 | 4
-                l5 = self.generate_l5(params['flp'].random())
-                if random.random() > 0.5:
-                    l34 = l34_1
+                flags = 16
+                length = params['flp'].random(rng)
+                if rng.random() > 0.5:
+                    direction = 0
                     seq = seq1
                     ack = seq2
                     params = params1
-                    seq1 += len(l5)
+                    seq1 += payload_pool.size(length)
                 else:
-                    l34 = l34_2
+                    direction = 1
                     seq = seq2
                     ack = seq1
                     params = params2
-                    seq2 += len(l5)
+                    seq2 += payload_pool.size(length)
                 if t >= t1:
                     state = 'F1'
 
             # завершение
             elif state == 'F1':
 
-                l34 = l34_2
-                l5 = self.generate_l5(params['flp'].random())
-                flags_on = 1 | 16  # 1 - FIN
-                flags_off = 2 | 4
+                direction = 1
+                length = params['flp'].random(rng)
+                flags = 1 | 16
                 seq = seq2
                 ack = seq1
                 params = params2
-                seq2 += len(l5)
+                seq2 += payload_pool.size(length)
                 state = 'F2'
 
             elif state == 'F2':
-                l34 = l34_1
-                l5 = self.generate_l5(params['flp'].random())
-                flags_on = 1 | 16
-                flags_off = 2 | 4
+                direction = 0
+                length = params['flp'].random(rng)
+                flags = 1 | 16
                 seq = seq1
                 ack = seq2
                 params = params1
-                seq1 += len(l5)
+                seq1 += payload_pool.size(length)
                 state = 'Q'
 
             seq1 %= seq_mod  # сохранение в пределах допустимых значений
             seq2 %= seq_mod
 
-            l34[TCP].flags |= flags_on
-            l34[TCP].flags &= ~flags_off
-            l34[TCP].seq = seq
-            l34[TCP].ack = ack
-            l34[IP].ttl = params['fttl'].random()
+            yield t, direction, flags, seq, ack, params['fttl'].random(rng), length
 
-            p = l34 / l5
-            p.time = t
-
-            packets.append(p)
-
-            tp = params['ftp'].random()
+            tp = params['ftp'].random(rng)
             t += tp
 
-        return packets
-
 
 # =============================================================================
 
@@ -333,7 +562,7 @@ class FlowUDP(FlowSock):
     >>> nets  = [('a', 'l'), ('b', 'r')]
     >>> nodes = [0, 1]
     >>> t     = Translator(nets, nodes)
-    >>> packs = f.generate(t, 42.0)
+    >>> packs = list(f.generate(t, 42.0))
     >>> 950 < len(packs) < 1050
     True
     >>> (packs[0][UDP].sport, packs[0][UDP].dport)
@@ -348,7 +577,9 @@ class FlowUDP(FlowSock):
 
     def generate(self, translator, t0):
 
-        t1 = t0 + self.ftf.random()
+        return self.materialize(translator, self.plan(t0))
+
+    def materialize(self, translator, schedule):
 
         ip1 = translator.node2ip[self.node1]
         ip2 = translator.node2ip[self.node2]
@@ -358,30 +589,22 @@ class FlowUDP(FlowSock):
         l3_2 = IP(src=ip2, dst=ip1)
         l4_2 = UDP(sport=self.port2, dport=self.port1)
 
-        l34_1 = l3_1 / l4_1
-        l34_2 = l3_2 / l4_2
-        params1 = {'ftp': self.ftp1, 'flp': self.flp1, 'fttl': self.fttl1}
-        params2 = {'ftp': self.ftp2, 'flp': self.flp2, 'fttl': self.fttl2}
+        l34s = (l3_1 / l4_1, l3_2 / l4_2)
 
-        packets = []
-        t = t0
-
-        while t < t1:
-            if not self.fhf.random():
-                l34 = l34_1
-                params = params1
-            else:
-                l34 = l34_2
-                params = params2
-            l5 = self.generate_l5(params['flp'].random())
-            l34[IP].ttl = params['fttl'].random()
-            p = l34 / l5
+        for t, direction, length, ttl in schedule.rows():
+            l34 = l34s[direction]
+            l34[IP].ttl = ttl
+            p = l34 / self.generate_l5(length)
             p.time = t
-            packets.append(p)
-            tp = params['ftp'].random()
-            t += tp
+            yield p
 
-        return packets
+    def generate_raw(self, translator, t0):
+
+        ip1 = inet_aton(translator.node2ip[self.node1])
+        ip2 = inet_aton(translator.node2ip[self.node2])
+        templates = (UDPTemplate(ip1, ip2, self.port1, self.port2), UDPTemplate(ip2, ip1, self.port2, self.port1))
+        for t, direction, length, ttl in self.plan(t0).rows():
+            yield t, direction, templates[direction].build(ttl, *payload_pool.take(length))
 
 
 # =============================================================================
@@ -407,23 +630,28 @@ class FlowICMP(Flow):
     def __repr__(self):
         return """type1:{0}, type2:{1}""".format(self.type2, self.type2)
 
+    def canonical(self):
+        return super(FlowICMP, self).canonical() + (self.type1, self.type2)
+
     @staticmethod
-    def random_type():
-        return random.randint(0, 40)
+    def random_type(rng=None):
+        return (rng or random).randint(0, 40)
 
-    def mutation(self):
-        mutation_index = random.randint(0, len(self.fxs) + 1)
+    def mutation(self, rng=None):
+        rng = rng or random
+        mutation_index = rng.randint(0, len(self.fxs) + 1)
         if mutation_index == len(self.fxs):  # мутирует тип1
-            self.type1 = self.random_type()
-        if mutation_index > len(self.fxs):  # мутирует тип2
-            self.type2 = self.random_type()
+            self.type1 = self.random_type(rng)
+        elif mutation_index > len(self.fxs):  # мутирует тип2
+            self.type2 = self.random_type(rng)
         else:
-            self.fxs[mutation_index].mutation()
+            self.fxs[mutation_index].mutation(rng)
+        self.mark_dirty()
 
-    def random_initialize(self, node1, node2):
-        Flow.random_initialize(self, node1, node2)
-        self.type1 = self.random_type()
-        self.type2 = self.random_type()
+    def random_initialize(self, node1, node2, rng=None):
+        Flow.random_initialize(self, node1, node2, rng)
+        self.type1 = self.random_type(rng)
+        self.type2 = self.random_type(rng)
 
     def copy(self, g):
         if not isinstance(g, FlowICMP):
@@ -434,14 +662,12 @@ class FlowICMP(Flow):
         g.type2 = self.type2
         return
 
-    def clone(self):
-        clone = FlowICMP(self.type1, self.type2, self.node1, self.node2, self.ftp1, self.flp1, self.fttl1, self.ftp2,
-                         self.flp2, self.fttl2, self.ftf, self.fhf)
-        self.copy(clone)
-        return clone
-
     def generate(self, translator, t0):
 
+        return self.materialize(translator, self.plan(t0))
+
+    def materialize(self, translator, schedule):
+
         ip1 = translator.node2ip[self.node1]
         ip2 = translator.node2ip[self.node2]
 
@@ -450,59 +676,68 @@ class FlowICMP(Flow):
         l3_2 = IP(src=ip2, dst=ip1)
         l4_2 = ICMP(type=self.type2)
 
-        l34_1 = l3_1 / l4_1
-        l34_2 = l3_2 / l4_2
+        l34s = (l3_1 / l4_1, l3_2 / l4_2)
 
-        params1 = {'ftp': self.ftp1, 'flp': self.flp1, 'fttl': self.fttl1}
-        params2 = {'ftp': self.ftp2, 'flp': self.flp2, 'fttl': self.fttl2}
+        for (t, direction, length, ttl), seq in zip(schedule.rows(), self.sequence_numbers(schedule)):
+            l34 = l34s[direction]
+            l34['ICMP'].seq = seq
+            l34['IP'].ttl = ttl
+            p = l34 / self.generate_l5(length)
+            p.time = t
+            yield p
+
+    def generate_raw(self, translator, t0):
+
+        ip1 = inet_aton(translator.node2ip[self.node1])
+        ip2 = inet_aton(translator.node2ip[self.node2])
+        templates = (ICMPTemplate(ip1, ip2, self.type1), ICMPTemplate(ip2, ip1, self.type2))
+        schedule = self.plan(t0)
+        for (t, direction, length, ttl), seq in zip(schedule.rows(), self.sequence_numbers(schedule)):
+            yield t, direction, templates[direction].build(seq, ttl, *payload_pool.take(length))
+
+    @staticmethod
+    def sequence_numbers(schedule):
+        """
+        номера последовательности ICMP для пакетов расписания:
+        запросы нумеруются по порядку, ответ повторяет номер последнего запроса
+        """
 
         seq = 0
         ack = 0
-
-        packets = []
-        t1 = t0 + self.ftf.random()
-        t = t0
-        while t < t1:
-            if not self.fhf.random():
-                l34 = l34_1
-                params = params1
-                l34['ICMP'].seq = seq
+        numbers = []
+        for direction in schedule.directions.tolist():
+            if not direction:
+                numbers.append(seq)
                 ack = seq
                 seq += 1
             else:
-                l34 = l34_2
-                params = params2
-                l34['ICMP'].ack = ack
-
-            tp = params['ftp'].random()
-
-            l5 = self.generate_l5(params['flp'].random())
-            l34['IP'].time = t
-            l34['IP'].ttl = params['fttl'].random()
-            p = l34 / l5
-            packets.append(p)
-
-            t += tp
-
-        return packets
+                numbers.append(ack)
+        return numbers
 
 
 # =============================================================================
 
 
-def random_flow(node1, node2):
-    params = [node1, node2, FTP().random_initialize(), FLP().random_initialize(), FTTL().random_initialize(),
-              FTP().random_initialize(), FLP().random_initialize(), FTTL().random_initialize(),
-              FTF().random_initialize(), FHF().random_initialize()]
+def random_flow(node1, node2, rng=None):
+    """
+    случайный поток между узлами node1 и node2
+    rng - генератор (random.Random), по умолчанию модуль random;
+          зерно генерации пакетов потока берется из него же
+    """
+    rng = rng or random
+    params = [node1, node2, FTP().random_initialize(rng), FLP().random_initialize(rng), FTTL().random_initialize(rng),
+              FTP().random_initialize(rng), FLP().random_initialize(rng), FTTL().random_initialize(rng),
+              FTF().random_initialize(rng), FHF().random_initialize(rng)]
     # выбираем тип потока - равновероятно
-    choice = random.randint(0, 2)
+    choice = rng.randint(0, 2)
     if choice == 0:
-        params = [FlowICMP.random_type(), FlowICMP.random_type()]+params
-        return FlowICMP(*params)
-    if choice == 1:
-        params = [FlowSock.random_port(), FlowSock.random_port()]+params
-        return FlowTCP(*params)
+        params = [FlowICMP.random_type(rng), FlowICMP.random_type(rng)]+params
+        flow = FlowICMP(*params)
+    elif choice == 1:
+        params = [FlowSock.random_port(rng), FlowSock.random_port(rng)]+params
+        flow = FlowTCP(*params)
     else:
-        params = [FlowSock.random_port(), FlowSock.random_port()]+params
-        return FlowUDP(*params)
-
+        params = [FlowSock.random_port(rng), FlowSock.random_port(rng)]+params
+        flow = FlowUDP(*params)
+    flow.seed = rng.randint(0, MAX_SEED)
+    return flow
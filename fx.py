@@ -2,13 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import random
+from array import array
+from bisect import bisect_left
+
+import numpy
 
 
 class FX(object):
     """
     универсальный класс ФРВ
+    точки хранятся в двух типизированных массивах (вероятности и значения),
+    список точек points строится по ним при обращении
     """
 
+    __slots__ = ('v_type', 'v_from', 'v_to', 'v_delta', 'probabilities', 'values', '__sampler')
+
     def __init__(self, v_from=0, v_to=1, v_type=int, points=None):
 
         """
@@ -64,6 +72,9 @@ class FX(object):
         # вида (вероятность, значение)
         # трансп., т.к. первой указывается вероятность
         self.points = []
+        # таблица выборки numpy (кумулятивные вероятности, значения),
+        # строится лениво в sample() и сбрасывается при любом изменении точек
+        self.__sampler = None
         # нормализованные точки (т.е. все v от 0 до 1,
         # где 0 соотв. v_from, а 1 - v_to
         # self.points_normalized = []
@@ -90,17 +101,14 @@ class FX(object):
         if len(points) < 1:
             raise ValueError
 
-        self.points = []
+        loaded = []
         seen = set()
         for p in points:
             if not ((0 <= p[0] <= 1) and (self.v_from <= p[1] <= self.v_to)):
                 raise ValueError(p, self.v_from, self.v_to)
             if p[0] not in seen and not seen.add(p[0]):
-                self.points.append([p[0], self.v_type(p[1])])
-        self.points.sort(key=lambda x: x[0])
-        # вероятность последней точки всегда = 1
-        self.points[-1][0] = 1.0
-        # self.__update_points_normalized()
+                loaded.append((p[0], self.v_type(p[1])))
+        self.__set_sorted(loaded)
 
     # -------------------------------------------------------------------------
 
@@ -113,43 +121,81 @@ Points: {3}
 Normalized points: {4}
         """, self.v_type, self.v_from, self.v_to, self.points, self.points_normalized)
 
+    @property
+    def points(self):
+        """
+        снимок точек [вероятность, значение]: список строится заново из массивов
+        probabilities и values при каждом обращении, поэтому изменение его элементов
+        (f.points[i][j] = x) не меняет ФРВ; точки изменяются только через методы ФРВ,
+        присваивание points или массивы probabilities и values
+        """
+        return [[p, v] for p, v in zip(self.probabilities, self.values)]
+
+    @points.setter
+    def points(self, points):
+        self.probabilities = array('d', [p[0] for p in points])
+        self.values = array(self.__value_typecode(), [p[1] for p in points])
+        self.__sampler = None
+
+    def __value_typecode(self):
+        return 'l' if self.v_type == int else 'd'
+
+    def __set_sorted(self, points):
+        """
+        замена точек на points, упорядоченные по вероятности
+        """
+        self.points = sorted(points, key=lambda x: x[0])
+        # вероятность последней точки всегда = 1
+        self.probabilities[-1] = 1.0
+
     @property
     def points_normalized(self):
-        return map(lambda x: [x[0], float(x[1] - self.v_from) / self.v_delta], self.points)
+        v_from = self.v_from
+        v_delta = float(self.v_delta)
+        return [[p, (v - v_from) / v_delta] for p, v in zip(self.probabilities, self.values)]
 
     # -------------------------------------------------------------------------
 
-    def __mutation_vi(self, i):
+    def __mutation_vi(self, i, rng):
 
         """
         случайная мутация значения (v) i-й точки
+        новое значение отличается от старого, если диапазон это допускает
         """
 
-        self.points[i][1] = self.v_type(self.v_from + random.random() * self.v_delta)
-        # self.__update_points_normalized()
+        if self.v_from == self.v_to:
+            return
+        old = self.values[i]
+        while self.values[i] == old:
+            self.values[i] = self.v_type(self.v_from + rng.random() * self.v_delta)
+        self.__sampler = None
 
     # -------------------------------------------------------------------------
 
-    def __mutation_pi(self, i):
+    def __mutation_pi(self, i, rng):
 
         """
         случайная мутация вероятности (p) i-й точки
+        вероятность последней точки всегда равна 1, поэтому вместо нее
+        мутирует одна из остальных точек
         """
+        if len(self.probabilities) < 2:
+            return
+        if i == len(self.probabilities) - 1:
+            i = rng.randint(0, i - 1)
         # TODO: Уточнить
         # вычислить новую вероятность
-        new_p = random.random() * 0.99  # должно быть < 1
+        new_p = rng.random() * 0.99  # должно быть < 1
         # нормализовать остальные
         # scale = (1. - self.points[i][0]) / (1. - new_p)
         # for pnt in self.points:
         #    pnt[0] /= scale
-        self.points[i][0] = new_p
-        # вероятность последней точки всегда = 1
-        self.points.sort(key=lambda x: x[0])
-        self.points[-1][0] = 1.0
+        self.probabilities[i] = new_p
+        self.__set_sorted(zip(self.probabilities, self.values))
 
     # -------------------------------------------------------------------------
 
-    def mutation_p(self):
+    def mutation_p(self, rng=None):
 
         """
         случайная мутация вероятностей (p) точек функции
@@ -166,11 +212,12 @@ Normalized points: {4}
         True
         """
 
-        self.__mutation_pi(random.randint(0, len(self.points) - 1))
+        rng = rng or random
+        self.__mutation_pi(rng.randint(0, len(self.points) - 1), rng)
 
     # -------------------------------------------------------------------------
 
-    def mutation_v(self):
+    def mutation_v(self, rng=None):
 
         """
         случайная мутация значений (v) точек функции
@@ -189,15 +236,17 @@ Normalized points: {4}
         True
         """
 
-        self.__mutation_vi(random.randint(0, len(self.points) - 1))
+        rng = rng or random
+        self.__mutation_vi(rng.randint(0, len(self.points) - 1), rng)
 
     # -------------------------------------------------------------------------
 
-    def mutation(self):
+    def mutation(self, rng=None):
 
         """
         случайная мутация точек функции
         может оказатся измененным как значение, так и вероятность
+        rng - генератор (random.Random), по умолчанию модуль random
         >>> f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
         >>> old_points = f.points[:]
         >>> f.mutation()
@@ -218,27 +267,62 @@ Normalized points: {4}
         True
         """
 
+        rng = rng or random
         # индекс точки
-        i = random.randint(0, len(self.points) - 1)
+        i = rng.randint(0, len(self.points) - 1)
 
         # c вероятностью 0.25 мутация вероятности или значения или количества
-        choice = random.randint(0, 3 if len(self.points) > 1 else 2)
-        print choice
+        choice = rng.randint(0, 3 if len(self.points) > 1 else 2)
         if choice == 0:
-            self.__mutation_vi(i)
+            self.__mutation_vi(i, rng)
         elif choice == 1:
-            self.__mutation_pi(i)
+            self.__mutation_pi(i, rng)
         elif choice == 2:
-            self.__add_random_point()
+            self.__add_random_point(rng)
         else:
             self.__remove_point(i)
 
     # -------------------------------------------------------------------------
 
-    def random(self):
+    def blend(self, other, rng=None):
+
+        """
+        арифметическое смешивание точек двух ФРВ одного класса (кроссовер):
+        i-я точка каждой ФРВ сдвигается к i-й точке другой на случайную долю,
+        лишние точки более длинной ФРВ не изменяются; изменяются обе ФРВ
+        >>> f1 = FX(0, 10, int, [[0.5, 0], [1.0, 10]])
+        >>> f2 = FX(0, 10, int, [[0.5, 10], [1.0, 0]])
+        >>> f1.blend(f2, random.Random(1))
+        >>> [v1 + v2 for (p1, v1), (p2, v2) in zip(f1.points, f2.points)]
+        [10, 10]
+        """
+
+        if type(other) != type(self):
+            raise ValueError("Expected: {0}, got: {1}".format(type(self), type(other)))
+        rng = rng or random
+        mine = zip(self.probabilities, self.values)
+        theirs = zip(other.probabilities, other.values)
+        for i in xrange(min(len(mine), len(theirs))):
+            a = rng.random()
+            (p1, v1), (p2, v2) = mine[i], theirs[i]
+            mine[i] = (p1 + a * (p2 - p1), self.__blend_value(v1, v2, a))
+            theirs[i] = (p2 + a * (p1 - p2), self.__blend_value(v2, v1, a))
+        self.load(mine)
+        other.load(theirs)
+
+    def __blend_value(self, v1, v2, a):
+        v = v1 + a * (v2 - v1)
+        if self.v_type == int:
+            v = int(round(v))
+        return min(max(v, self.v_from), self.v_to)
+
+    # -------------------------------------------------------------------------
+
+    def random(self, rng=None):
 
         """
         возвращает случайное значение, вычисленное по данной ФРВ
+        rng - генератор (random.Random), по умолчанию модуль random
         >>> f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
         >>> counts = {}
         >>> for i in xrange(10000):
@@ -253,30 +337,137 @@ Normalized points: {4}
         True
         """
 
-        r = random.random()
-        i = 0
-        while r > self.points[i][0]:
-            i += 1
-        if not (self.v_from <= self.points[i][1] <= self.v_to):
-            raise ValueError(self.points[i][1], self.v_from, self.v_to)
-        return self.points[i][1]
+        if self.__sampler is None:
+            self.__compile()
+        # первая точка, вероятность которой >= r
+        return self.values[bisect_left(self.probabilities, (rng or random).random())]
+
+    def mean(self):
+
+        """
+        математическое ожидание значения: i-е значение выпадает
+        с вероятностью p[i] - p[i - 1] (см. random)
+        >>> FX(0, 100, int, [[0.25, 40], [1.0, 80]]).mean()
+        70.0
+        """
+
+        mean = 0.0
+        previous = 0.0
+        for p, v in zip(self.probabilities, self.values):
+            mean += (p - previous) * v
+            previous = p
+        return mean
+
+    def distribution(self):
+
+        """
+        распределение значений: пары (значение, вероятность) по возрастанию
+        значений, вероятности равных значений складываются
+        >>> FX(0, 100, int, [[0.25, 40], [0.5, 10], [1.0, 40]]).distribution()
+        [(10, 0.25), (40, 0.75)]
+        """
+
+        masses = {}
+        previous = 0.0
+        for p, v in zip(self.probabilities, self.values):
+            masses[v] = masses.get(v, 0.0) + p - previous
+            previous = p
+        return sorted(masses.items())
+
+    def variance(self):
+
+        """
+        дисперсия значения
+        >>> FX(0, 100, int, [[0.5, 40], [1.0, 80]]).variance()
+        400.0
+        """
+
+        mean = self.mean()
+        return sum(m * (v - mean) ** 2 for v, m in self.distribution())
+
+    def cdf(self, v):
+
+        """
+        функция распределения: вероятность значения, не большего v
+        >>> f = FX(0, 100, int, [[0.25, 40], [1.0, 80]])
+        >>> f.cdf(39), f.cdf(40), f.cdf(100)
+        (0.0, 0.25, 1.0)
+        """
+
+        return sum((m for value, m in self.distribution() if value <= v), 0.0)
+
+    def quantile(self, q):
+
+        """
+        квантиль уровня q: наименьшее значение, вероятность не превысить
+        которое не меньше q
+        >>> f = FX(0, 100, int, [[0.25, 40], [1.0, 80]])
+        >>> f.quantile(0.1), f.quantile(0.25), f.quantile(0.5)
+        (40, 40, 80)
+        """
+
+        if not (0 <= q <= 1):
+            raise ValueError(q)
+        total = 0.0
+        distribution = self.distribution()
+        for value, m in distribution:
+            total += m
+            # накопленная сумма вероятностей может недотягивать до q из-за округления
+            if m > 0 and total >= q - 1e-12:
+                return value
+        return distribution[-1][0]
+
+    def sample(self, n, rng=None):
+
+        """
+        возвращает массив numpy из n случайных значений по данной ФРВ,
+        вычисленных за один векторный проход
+        rng - генератор numpy (RandomState), по умолчанию глобальный numpy.random
+        >>> f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
+        >>> s = f.sample(10000)
+        >>> sorted(set(s.tolist()))
+        [9, 42]
+        >>> 0.23 < float((s == 42).sum()) / (s == 9).sum() < 0.27
+        True
+        >>> FX(0, 1, float, [[1.0, 0.5]]).sample(3).tolist()
+        [0.5, 0.5, 0.5]
+        """
+
+        if rng is None:
+            rng = numpy.random
+        if self.__sampler is None:
+            self.__compile()
+        cdf, values = self.__sampler
+        return values[numpy.searchsorted(cdf, rng.random_sample(n), side='left')]
+
+    def __compile(self):
+        """
+        проверка точек и построение таблицы выборки numpy:
+        кумулятивные вероятности и соответствующие им значения
+        """
+        for v in self.values:
+            if not (self.v_from <= v <= self.v_to):
+                raise ValueError(v, self.v_from, self.v_to)
+        dtype = numpy.int64 if self.v_type == int else numpy.float64
+        self.__sampler = (numpy.array(self.probabilities, dtype=numpy.float64), numpy.array(self.values, dtype=dtype))
 
-    def __add_random_point(self):
+    def __add_random_point(self, rng):
         """
         добавляет случайно сгенерированную точку
         """
-        new_p = random.random() * 0.99
-        new_v = self.v_type(self.v_from + random.random() * self.v_delta)
-        self.points += [[new_p, new_v]]
-        self.points.sort(key=lambda point: point[0])
+        new_p = rng.random() * 0.99
+        new_v = self.v_type(self.v_from + rng.random() * self.v_delta)
+        self.points = sorted(self.points + [[new_p, new_v]], key=lambda point: point[0])
 
     def __remove_point(self, i):
         """
         удаляет случайную точку
         """
-        if len(self.points) > 1:
-            del self.points[i]
-            self.points[-1][0] = 1.0
+        if len(self.probabilities) > 1:
+            del self.probabilities[i]
+            del self.values[i]
+            self.probabilities[-1] = 1.0
+            self.__sampler = None
 
     def copy(self, g):
         """
@@ -285,31 +476,55 @@ Normalized points: {4}
         if not isinstance(g, type(self)):
             raise ValueError("Expected: {0}, got: {1}".format(type(self), type(g)))
 
-        g.points = self.points
         g.v_delta = self.v_delta
         g.v_from = self.v_from
         g.v_to = self.v_to
         g.v_type = self.v_type
-        g.points = []
-        for p in self.points:
-            g.points.append(p[:])
+        # срез массива - одно выделение памяти и копирование буфера
+        g.probabilities = self.probabilities[:]
+        g.values = self.values[:]
+        g.__sampler = None
         return
 
     def clone(self):
-        clone = FX(self.v_from, self.v_to, self.v_type)
+        """
+        копия ФРВ без конструктора: все поля заполняет copy
+        """
+        clone = type(self).__new__(type(self))
         return self.__clone__(clone)
 
+    def canonical(self):
+        """
+        каноническое представление ФРВ для хэширования (см. NetworkGenome.content_hash)
+        >>> FTP([[0.5, 0.01], [1.0, 0.02]]).canonical()
+        ('FTP', 'float', 0, 0.1, ((0.5, 0.01), (1.0, 0.02)))
+        """
+        return (type(self).__name__, self.v_type.__name__, self.v_from, self.v_to,
+                tuple(zip(self.probabilities, self.values)))
+
+    def __getstate__(self):
+        """
+        при передаче в другой процесс кэш выборки не сериализуется,
+        он восстанавливается при первом обращении
+        """
+        return self.v_type, self.v_from, self.v_to, self.v_delta, self.probabilities, self.values
+
+    def __setstate__(self, state):
+        self.v_type, self.v_from, self.v_to, self.v_delta, self.probabilities, self.values = state
+        self.__sampler = None
+
     def __clone__(self, new_instance):
         self.copy(new_instance)
         return new_instance
 
-    def random_initialize(self):
-        fflow_points_count = random.randint(1, 10)
+    def random_initialize(self, rng=None):
+        rng = rng or random
+        fflow_points_count = rng.randint(1, 10)
         new_points = []
         for i in xrange(fflow_points_count):
-            v = self.v_type(self.v_from + random.random() * self.v_delta)
+            v = self.v_type(self.v_from + rng.random() * self.v_delta)
             assert self.v_from <= v <= self.v_to
-            p = random.random() * 0.99
+            p = rng.random() * 0.99
             new_points.append([p, v])
         self.load(new_points)
         return self
@@ -318,56 +533,44 @@ Normalized points: {4}
 # =============================================================================
 
 class FTP(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FTP, self).__init__(0, 0.1, float, points)
 
-    def clone(self):
-        clone = FTP()
-        return self.__clone__(clone)
-
 
 class FLP(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FLP, self).__init__(100, 1300, int, points)
 
-    def clone(self):
-        clone = FLP()
-        return self.__clone__(clone)
-
 
 class FTTL(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FTTL, self).__init__(0, 100, int, points)
 
-    def clone(self):
-        clone = FTTL()
-        return self.__clone__(clone)
-
 
 class FTF(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FTF, self).__init__(0, 100, float, points)
 
-    def clone(self):
-        clone = FTF()
-        return self.__clone__(clone)
-
 
 class FFlow(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FFlow, self).__init__(0, 1e6, int, points)
 
-    def clone(self):
-        clone = FFlow()
-        return self.__clone__(clone)
-
 
 class FHF(FX):
+    __slots__ = ()
+
     def __init__(self, points=None):
         super(FHF, self).__init__(0, 1, int, points)
 
-    def clone(self):
-        clone = FHF()
-        return self.__clone__(clone)
-
 # =============================================================================
@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import copy
+import hashlib
 import random
 
 from pyevolve import GenomeBase
 
-from flow import Flow, random_flow
+from flow import Flow, random_flow, MAX_SEED
 from fx import FFlow
 from nets_manager import directions, masks
-from tester import network_packets_count_tester
+import config
+from tester import network_cached_loss_tester, network_parallel_loss_tester
 
 
 class NetworkGenome(GenomeBase.GenomeBase):
@@ -15,27 +18,11 @@ class NetworkGenome(GenomeBase.GenomeBase):
     Класс, представляющий собой модель реальной сети, для эволюционирования в pyevolve
     """
 
-    def __init__(self, nets, nodes, flows, fflow, texp):
+    def __init__(self, nets, nodes, flows, fflow, texp, seed=None):
 
         GenomeBase.GenomeBase.__init__(self)
 
-        cls_names = masks  # cls_ranges.keys()
-
-        for n in nets:
-            if (n[0] not in cls_names) or (n[1] not in directions):
-                raise ValueError(n)
-        net_range = xrange(len(nets))
-        for n in nodes:
-            if n not in net_range:
-                raise ValueError(n)
-        node_range = len(nodes)
-        for f in flows:
-            if not isinstance(f, Flow):
-                raise ValueError(str(f))
-            if f.node1 >= node_range or f.node2 >= node_range:
-                raise ValueError
-        if (type(fflow) != FFlow) or (type(texp) != float):
-            raise ValueError
+        validate_genome(nets, nodes, flows, fflow, texp)
 
         self.nets = nets
         self.nodes = nodes
@@ -50,6 +37,11 @@ class NetworkGenome(GenomeBase.GenomeBase):
         # полный геном организма
         self.genome = self.fxs + [self.fflow]
 
+        # собственный генератор особи: мутации и кроссовер не зависят от общего
+        # состояния модуля random, поэтому прогон воспроизводим по зерну (см. config.seed)
+        self.seed = seed if seed is not None else random.randint(0, MAX_SEED)
+        self.rng = random.Random(self.seed)
+
         self.initializator.set(network_initializer)
 
         # В сети может мутировать:
@@ -66,12 +58,36 @@ class NetworkGenome(GenomeBase.GenomeBase):
         self.mutator.add(fflow_mutator)
 
         self.crossover.set(network_crossover)
-        self.evaluator.set(network_packets_count_tester)
+        # при оценке через пул (parallel, surrogate) кэш проверяет parallel.CachedPool,
+        # поэтому сама оценка особи идет без кэша
+        pooled = config.parallel_evaluation or config.surrogate_top_k
+        self.evaluator.set(network_parallel_loss_tester if pooled else network_cached_loss_tester)
 
     def __repr__(self):
         return str(self.texp) + '||' + str(self.fflow) + '||' + str(self.nets) + '||' + str(self.nodes) + '||' + str(
             self.flows)
 
+    def canonical(self):
+        """
+        каноническое представление генома: равные по содержанию геномы
+        имеют равные представления независимо от истории их получения
+        """
+        return (self.texp, self.fflow.canonical(), tuple(self.nets), tuple(self.nodes),
+                tuple(f.canonical() for f in self.flows))
+
+    def dirty_flows(self):
+        """
+        индексы потоков, измененных после построения их планов пакетов:
+        при следующей оценке заново генерируются только они
+        """
+        return [i for i, f in enumerate(self.flows) if f.dirty]
+
+    def content_hash(self):
+        """
+        хэш содержимого генома, ключ кэша оценок (см. fitness_cache)
+        """
+        return hashlib.sha1(repr(self.canonical())).hexdigest()
+
     # Реализация контракта pyevolve
     def copy(self, g):
         g.nets = self.nets[:]
@@ -89,123 +105,201 @@ class NetworkGenome(GenomeBase.GenomeBase):
 
     # Реализация контракта pyevolve
     def clone(self):
-        if not all(n < len(self.nets) for n in self.nodes):
-            raise ValueError
-        clone = NetworkGenome(self.nets, self.nodes, self.flows, self.fflow, self.texp)
+        """
+        копия особи без повторной проверки: содержимое оригинала уже проверено
+        конструктором и мутаторами, копия проверяется только в отладочном
+        режиме (см. config.validate_clones)
+        """
+        # поверхностная копия вместо конструктора: слоты функций pyevolve
+        # общие для копий, как в GenomeBase.copy, остальное заменяет copy
+        clone = copy.copy(self)
+        clone.score = 0.0
+        clone.fitness = 0.0
+        # зерно копии порождается генератором оригинала, поэтому копии одной особи
+        # мутируют по-разному, но воспроизводимо
+        clone.seed = self.rng.randint(0, MAX_SEED)
+        clone.rng = random.Random(clone.seed)
         self.copy(clone)
+        if config.validate_clones:
+            validate_genome(clone.nets, clone.nodes, clone.flows, clone.fflow, clone.texp)
         return clone
 
 
+def validate_genome(nets, nodes, flows, fflow, texp):
+    """
+    полная проверка содержимого генома при создании особи извне
+    """
+
+    cls_names = masks  # cls_ranges.keys()
+
+    for n in nets:
+        if (n[0] not in cls_names) or (n[1] not in directions):
+            raise ValueError(n)
+    net_range = xrange(len(nets))
+    for n in nodes:
+        if n not in net_range:
+            raise ValueError(n)
+    node_range = len(nodes)
+    for f in flows:
+        if not isinstance(f, Flow):
+            raise ValueError(str(f))
+        if f.node1 >= node_range or f.node2 >= node_range:
+            raise ValueError
+    if (type(fflow) != FFlow) or (type(texp) != float):
+        raise ValueError
+
+
 def delete_node(genome, index):
     check_genome(genome)
-    flows = []
-    nodes = genome.nodes
-    nets = []
+    delete_nodes(genome, [index])
+    check_genome(genome)
+    return
 
+
+def delete_nodes(genome, indices, collect=True):
+    """
+    удаление узлов с индексами indices вместе с их потоками за один проход:
+    новые индексы оставшихся узлов берутся из таблицы перенумерации
+    collect - удалить сети, в которых не осталось узлов (см. collect_nets)
+    """
+    removed = set(indices)
+    # старый индекс узла -> новый, None - узел удален
+    remap = []
+    nodes = []
+    for index, net in enumerate(genome.nodes):
+        if index in removed:
+            remap.append(None)
+        else:
+            remap.append(len(nodes))
+            nodes.append(net)
+
+    flows = []
     for f in genome.flows:
-        if f.node1 != index and f.node2 != index:
+        node1 = remap[f.node1]
+        node2 = remap[f.node2]
+        if node1 is not None and node2 is not None:
+            f.node1 = node1
+            f.node2 = node2
             flows.append(f)
 
-    # при удалении узла надо поменять индексы в потоках
-    for f in flows:
-        if f.node1 > index:
-            f.node1 -= 1
-        if f.node2 > index:
-            f.node2 -= 1
+    genome.nodes = nodes
+    genome.flows = flows
+    if collect:
+        collect_nets(genome)
+    return
 
-    del nodes[index]
 
-    # # удаляем неиспользуемые сети
-    # for net_index in xrange(len(genome.nets)):
-    # if any(node == net_index for node in nodes):
-    #         nets.append(genome.nets[net_index])
-    # genome.nets = nets
+def delete_net(genome, net_index):
+    """
+    удаление сети вместе с ее узлами и их потоками
+    """
+    delete_nodes(genome, [i for i, net in enumerate(genome.nodes) if net == net_index], collect=False)
+    remove_nets(genome, [net_index])
+    collect_nets(genome)
+    return
 
-    genome.nodes = nodes
-    genome.flows = flows
 
-    check_genome(genome)
+def remove_nets(genome, indices):
+    """
+    удаление сетей с индексами indices, в которых нет узлов,
+    с перенумерацией сетей узлов за один проход
+    """
+    removed = set(indices)
+    # старый индекс сети -> новый, None - сеть удалена
+    remap = []
+    nets = []
+    for index, net in enumerate(genome.nets):
+        if index in removed:
+            remap.append(None)
+        else:
+            remap.append(len(nets))
+            nets.append(net)
+
+    genome.nodes = [remap[net] for net in genome.nodes]
+    genome.nets = nets
+    return
+
+
+def collect_nets(genome):
+    """
+    сборка мусора: удаление сетей, в которых не осталось узлов
+    у генома без узлов сети сохраняются, иначе в него нельзя будет добавить узел
+    """
+    if genome.nodes:
+        used = set(genome.nodes)
+        remove_nets(genome, [i for i in xrange(len(genome.nets)) if i not in used])
     return
 
 
 def network_mutator(genome, **args):
-    choice = random.randint(0, len(genome.nets) + 1) if len(genome.nets) != 1 else random.choice(
+    choice = genome.rng.randint(0, len(genome.nets) + 1) if len(genome.nets) != 1 else genome.rng.choice(
         xrange(len(genome.nets) + 1))
 
     if choice < len(genome.nets):
-        if random.randint(0, 1):
-            genome.nets[choice] = (random.choice(masks), genome.nets[choice][1])
-        else:
-            genome.nets[choice] = (genome.nets[choice][0], random.choice(directions))
+        old_net = genome.nets[choice]
+        while genome.nets[choice] == old_net:
+            if genome.rng.randint(0, 1):
+                genome.nets[choice] = (genome.rng.choice(masks), old_net[1])
+            else:
+                genome.nets[choice] = (old_net[0], genome.rng.choice(directions))
 
     elif choice == len(genome.nets):
-        genome.nets.append((random.choice(masks), random.choice(directions)))
+        genome.nets.append((genome.rng.choice(masks), genome.rng.choice(directions)))
 
     else:
-        net_to_del = random.choice(xrange(len(genome.nets)))
-
-        # вместе с сетью нужно удалить узлы и потоки
-        while any(net_index == net_to_del for net_index in genome.nodes):
-            next_index = next(
-                node_index for node_index in xrange(len(genome.nodes)) if genome.nodes[node_index] == net_to_del)
-            delete_node(genome, next_index)
-
-        for n in xrange(len(genome.nodes)):
-            if genome.nodes[n] > net_to_del:
-                genome.nodes[n] -= 1
-
-        del genome.nets[net_to_del]
+        # вместе с сетью удаляются ее узлы и потоки
+        delete_net(genome, genome.rng.choice(xrange(len(genome.nets))))
 
     check_genome(genome)
     return 1
 
 
 def node_mutator(genome, **args):
-    choice = random.randint(0, len(genome.nodes) + 1) if len(genome.nodes) != 1 else random.choice(
+    choice = genome.rng.randint(0, len(genome.nodes) + 1) if len(genome.nodes) != 1 else genome.rng.choice(
         xrange(len(genome.nodes) + 1))
 
     if choice < len(genome.nodes):
         old_net = genome.nodes[choice]
         while genome.nodes[choice] == old_net:
-            genome.nodes[choice] = random.choice(xrange(len(genome.nets)))
+            genome.nodes[choice] = genome.rng.choice(xrange(len(genome.nets)))
 
     elif choice == len(genome.nodes):
-        genome.nodes.append(random.choice(xrange(len(genome.nets))))
+        genome.nodes.append(genome.rng.choice(xrange(len(genome.nets))))
     else:
-        delete_node(genome, random.choice(xrange(len(genome.nodes))))
+        delete_node(genome, genome.rng.choice(xrange(len(genome.nodes))))
 
     check_genome(genome)
     return 1
 
 
-def get_random_texp():
-    return random.random() * 100
+def get_random_texp(rng=None):
+    return (rng or random).random() * 100
 
 
 def texp_mutator(genome, **args):
     old = genome.texp
     while old == genome.texp:
-        genome.texp = get_random_texp()
+        genome.texp = get_random_texp(genome.rng)
 
     check_genome(genome)
     return 1
 
 
 def fflow_mutator(genome, **kwargs):
-    genome.fflow.mutation()
+    genome.fflow.mutation(genome.rng)
     check_genome(genome)
     return 1
 
 
 def flow_mutator(genome, **args):
-    choice = random.randint(0, len(genome.flows) + 1)
+    choice = genome.rng.randint(0, len(genome.flows) + 1)
     if choice < len(genome.flows):
-        genome.flows[choice].mutation()
+        genome.flows[choice].mutation(genome.rng)
     elif choice == len(genome.flows):
-        genome.flows.append(
-            random_flow(random.randint(0, len(genome.nodes) - 1), random.randint(0, len(genome.nodes) - 1)))
+        genome.flows.append(random_flow(genome.rng.randint(0, len(genome.nodes) - 1),
+                                        genome.rng.randint(0, len(genome.nodes) - 1), genome.rng))
     else:
-        del genome.flows[random.randint(0, len(genome.flows) - 1)]
+        del genome.flows[genome.rng.randint(0, len(genome.flows) - 1)]
 
     check_genome(genome)
     return 1
@@ -220,26 +314,47 @@ def network_crossover(genome, **args):
     sister.resetStats()
     brother.resetStats()
 
-    if random.randint(0, 1):
+    if config.crossover_blend:
+        sister.fflow.blend(brother.fflow, sister.rng)
+    elif sister.rng.randint(0, 1):
         sister.fflow, brother.fflow = brother.fflow, sister.fflow
-    if random.randint(0, 1):
+    if sister.rng.randint(0, 1):
         sister.texp, brother.texp = brother.texp, sister.texp
-    # одноточечный кроссовер функций распределения
 
-    cross = random.randint(0, min(len(sister.flows), len(brother.flows)) - 2) if min(len(sister.flows),
-                                                                                     len(brother.flows)) > 2 else 0
+    if config.crossover_blend:
+        for s_flow, b_flow in zip(sister.flows, brother.flows):
+            s_flow.blend(b_flow, sister.rng)
+
+    # потоки сестры и брата - непересекающиеся части копий родителей,
+    # поэтому потомки не разделяют объекты потоков
+    s_flows, s_flags = [], []
+    b_flows, b_flags = [], []
+    swaps = crossover_swaps[config.crossover](sister.rng, len(sister.flows), len(brother.flows))
+    for i, swap in enumerate(swaps):
+        own = [(sister.flows[i], 's')] if i < len(sister.flows) else []
+        other = [(brother.flows[i], 'b')] if i < len(brother.flows) else []
+        if swap:
+            own, other = other, own
+        for f, flag in own:
+            s_flows.append(f)
+            s_flags.append(flag)
+        for f, flag in other:
+            b_flows.append(f)
+            b_flags.append(flag)
+
+    # трансляция выполняется по узлам и сетям родителей до их замены
+    s_nets, s_nodes, s_endpoints = translate_nodes_and_nets(s_flows, sister.nodes, brother.nodes, sister.nets,
+                                                            brother.nets, s_flags.__getitem__)
+    b_nets, b_nodes, b_endpoints = translate_nodes_and_nets(b_flows, sister.nodes, brother.nodes, sister.nets,
+                                                            brother.nets, b_flags.__getitem__)
 
     # формируем геном сестры
-    s_flows = sister.flows[:cross] + brother.flows[cross:]
-    sister.nets, sister.nodes = translate_nodes_and_nets(s_flows, sister.nodes, brother.nodes, sister.nets,
-                                                         brother.nets, lambda x: 's' if x < cross else 'b')
-    sister.flows = s_flows
+    sister.nets, sister.nodes, sister.flows = s_nets, s_nodes, s_flows
+    set_endpoints(s_flows, s_endpoints)
 
     # формируем геном брата
-    b_flows = brother.flows[:cross] + sister.flows[cross:]
-    brother.nets, brother.nodes = translate_nodes_and_nets(b_flows, sister.nodes, brother.nodes, sister.nets,
-                                                           brother.nets, lambda x: 'b' if x < cross else 's')
-    brother.flows = b_flows
+    brother.nets, brother.nodes, brother.flows = b_nets, b_nodes, b_flows
+    set_endpoints(b_flows, b_endpoints)
 
     check_genome(sister)
     check_genome(brother)
@@ -247,63 +362,110 @@ def network_crossover(genome, **args):
     return sister, brother
 
 
+def one_point_swaps(rng, s_count, b_count):
+    """
+    признаки обмена потоков на позициях 0..max(s_count, b_count)-1
+    (True - поток позиции переходит к другому потомку): все потоки после точки разреза
+    """
+    min_count = min(s_count, b_count)
+    cross = rng.randint(0, min_count - 2) if min_count > 2 else 0
+    return [i >= cross for i in xrange(max(s_count, b_count))]
+
+
+def two_point_swaps(rng, s_count, b_count):
+    """
+    обмен потоков между двумя точками разреза в пределах общей длины
+    """
+    cross1, cross2 = sorted((rng.randint(0, min(s_count, b_count)), rng.randint(0, min(s_count, b_count))))
+    return [cross1 <= i < cross2 for i in xrange(max(s_count, b_count))]
+
+
+def uniform_swaps(rng, s_count, b_count):
+    """
+    обмен каждого потока с вероятностью 0.5
+    """
+    return [rng.random() < 0.5 for i in xrange(max(s_count, b_count))]
+
+
+# способы кроссовера потоков (см. config.crossover)
+crossover_swaps = {'one_point': one_point_swaps, 'two_point': two_point_swaps, 'uniform': uniform_swaps}
+
+
+def set_endpoints(flows, endpoints):
+    for f, (node1, node2) in zip(flows, endpoints):
+        f.node1 = node1
+        f.node2 = node2
+
+
 def translate_nodes_and_nets(flows, sister_nodes, brother_nodes, sister_nets, brother_nets, lambda_flag):
-    b_nodes = []
-    b_nets = []
-    node_dictionary = []
+    """
+    трансляция узлов и сетей потоков, собранных из двух геномов:
+    узлы и сети нумеруются заново в порядке первого использования
+    lambda_flag(i) - геном i-го потока ('s' - сестра, 'b' - брат)
+    возвращает (сети, узлы, концы потоков [(node1, node2)]); потоки не изменяются
+    """
+    # (старый индекс узла, флаг) -> новый индекс
+    node_dictionary = {}
+    node_keys = []
+    endpoints = []
 
     # транслируем узлы в новые
-    for i in xrange(len(flows)):
+    for i, f in enumerate(flows):
         flag = lambda_flag(i)
-        if [flows[i].node1, flag] not in node_dictionary:
-            node_dictionary.append([flows[i].node1, flag])
-        flows[i].node1 = node_dictionary.index([flows[i].node1, flag])
-
-        if [flows[i].node2, flag] not in node_dictionary:
-            node_dictionary.append([flows[i].node2, flag])
-        flows[i].node2 = node_dictionary.index([flows[i].node2, flag])
-
-    net_dictionary = []
+        ends = []
+        for node in (f.node1, f.node2):
+            key = (node, flag)
+            index = node_dictionary.get(key)
+            if index is None:
+                index = node_dictionary[key] = len(node_keys)
+                node_keys.append(key)
+            ends.append(index)
+        endpoints.append(tuple(ends))
+
+    # (старый индекс сети, флаг) -> новый индекс
+    net_dictionary = {}
+    b_nets = []
+    b_nodes = []
     # копируем сетки для узлов
-    for i in xrange(len(node_dictionary)):
-        flag = node_dictionary[i][1]
+    for node, flag in node_keys:
         nodes = sister_nodes if flag == 's' else brother_nodes
         nets = sister_nets if flag == 's' else brother_nets
-        old_index = nodes[node_dictionary[i][0]]
-        net = nets[old_index]
-        if [old_index, flag] not in net_dictionary:
-            net_dictionary.append([old_index, flag])
-            b_nets.append(net)
-        b_nodes.append(net_dictionary.index([old_index, flag]))
-
-    if any(item >= len(b_nets) for item in b_nodes) or len(b_nodes) == 0 or len(b_nets) == 0:
-        raise ValueError
-    if any(f.node1 >= len(b_nodes) or f.node2 >= len(b_nodes) for f in flows):
+        old_index = nodes[node]
+        key = (old_index, flag)
+        index = net_dictionary.get(key)
+        if index is None:
+            index = net_dictionary[key] = len(b_nets)
+            b_nets.append(nets[old_index])
+        b_nodes.append(index)
+
+    if len(b_nodes) == 0 or len(b_nets) == 0:
         raise ValueError
-    return b_nets, b_nodes
+    return b_nets, b_nodes, endpoints
 
 
 def network_initializer(genome, **args):
     """
     Функция создания новой произвольнй сети
+    rng - генератор (random.Random), по умолчанию генератор с зерном из модуля random
     """
+    rng = args.get('rng') or random.Random(random.randint(0, MAX_SEED))
     nets = []
-    for net in xrange(random.randint(1, 10)):
-        nets.append((random.choice(masks), random.choice(directions)))
+    for net in xrange(rng.randint(1, 10)):
+        nets.append((rng.choice(masks), rng.choice(directions)))
 
     nodes = []
-    for node in xrange(random.randint(1, 100)):
-        nodes.append(random.choice(xrange(len(nets))))
+    for node in xrange(rng.randint(1, 100)):
+        nodes.append(rng.choice(xrange(len(nets))))
 
     flows = []
-    for f in xrange(random.randint(1, 10)):
-        flows.append(random_flow(random.choice(xrange(len(nodes))), random.choice(xrange(len(nodes)))))
+    for f in xrange(rng.randint(1, 10)):
+        flows.append(random_flow(rng.choice(xrange(len(nodes))), rng.choice(xrange(len(nodes))), rng))
 
-    fflow = FFlow().random_initialize()
+    fflow = FFlow().random_initialize(rng)
 
-    texp = get_random_texp()
+    texp = get_random_texp(rng)
 
-    genome = NetworkGenome(nets, nodes, flows, fflow, texp)
+    genome = NetworkGenome(nets, nodes, flows, fflow, texp, rng.randint(0, MAX_SEED))
 
     check_genome(genome)
 
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+import random
+from Queue import Empty
+
+import numpy
+from pyevolve import Consts
+from pyevolve import GSimpleGA
+from pyevolve import Migration
+from pyevolve import Selectors
+
+import config
+from fitness_cache import fitness_cache
+from flow import MAX_SEED
+from genetic_engine import network_initializer
+from parallel import init_worker
+from tester import network_parallel_loss_tester
+
+# период проверки процессов островов при ожидании результатов, с
+ISLAND_POLL = 1.0
+
+log = logging.getLogger(__name__)
+
+
+def ring(island, count):
+    """
+    мигранты уходят следующему острову по кольцу
+    >>> [ring(i, 3) for i in xrange(3)]
+    [[1], [2], [0]]
+    """
+    return [(island + 1) % count] if count > 1 else []
+
+
+def full(island, count):
+    """
+    мигранты уходят всем остальным островам
+    >>> full(1, 3)
+    [0, 2]
+    """
+    return [i for i in xrange(count) if i != island]
+
+
+# топологии миграции (см. config.island_topology): остров, количество островов -> острова-получатели
+topologies = {'ring': ring, 'full': full}
+
+
+def island_evaluator(genome):
+    """
+    оценка особи острова: устройство под тестом общее для всех островов,
+    доступ к нему распределяет parallel.device_scheduler
+    """
+    return fitness_cache.evaluate(genome, network_parallel_loss_tester)
+
+
+def migrant(genome):
+    """
+    копия особи для отправки соседям: очередь сериализует особь позже, в своем
+    потоке, а популяция продолжает изменяться; оценка сохраняется для отбора
+    """
+    clone = genome.clone()
+    clone.score = genome.score
+    clone.fitness = genome.fitness
+    return clone
+
+
+class QueueMigration(Migration.MigrationScheme):
+    """
+    миграция между островами одной машины через очереди multiprocessing
+    раз в migration rate поколений лучшие особи острова копируются в очереди
+    соседей, а принятые из своей очереди особи заменяют худшие
+    inbox    - очередь острова
+    outboxes - очереди островов-получателей
+    """
+
+    def __init__(self, island, inbox, outboxes):
+        Migration.MigrationScheme.__init__(self, 'localhost', island, 'islands')
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.sent = 0
+        self.received = 0
+
+    def exchange(self):
+        # в начальном поколении особи еще не прошли отбор
+        if self.GAEngine.getCurrentGeneration() == 0 or not self.isReady():
+            return
+
+        population = self.GAEngine.getPopulation()
+        migrants = [migrant(population.bestRaw(i)) for i in xrange(min(self.getNumIndividuals(), len(population)))]
+        for outbox in self.outboxes:
+            outbox.put(migrants)
+            self.sent += len(migrants)
+
+        pool = []
+        while True:
+            try:
+                pool += self.inbox.get_nowait()
+            except Empty:
+                break
+        if not pool:
+            return
+
+        # лучшие из принятых заменяют худших
+        rev = self.GAEngine.getMinimax() == Consts.minimaxType['maximize']
+        pool.sort(key=lambda g: g.score, reverse=rev)
+        for i in xrange(min(self.getNumReplacement(), len(pool), len(population))):
+            population[len(population) - 1 - i] = pool[i]
+            self.received += 1
+
+    def stop(self):
+        # мигранты, не принятые завершившимися соседями, не должны задерживать выход процесса
+        for outbox in self.outboxes:
+            outbox.cancel_join_thread()
+
+
+def run_island(island, seed, inbox, outboxes, results, evaluator):
+    """
+    эволюция одной популяции в процессе острова; лучшая особь
+    передается в results вместе с номером острова и записями кэша оценок
+    """
+
+    init_worker()
+    # кэш, унаследованный от родителя, в файл не сохраняется: острова писали бы
+    # один файл одновременно; записи объединяет и сохраняет родительский процесс
+    fitness_cache.path = None
+    # pyevolve выбирает особи через модуль random, особи получают зерна из него же
+    random.seed(seed)
+    numpy.random.seed(seed)
+
+    genome = network_initializer(None)
+    genome.evaluator.set(evaluator)
+    ga = GSimpleGA.GSimpleGA(genome)
+    ga.selector.set(Selectors.GRouletteWheel)
+    ga.setGenerations(config.generations)
+    ga.setPopulationSize(config.population_size)
+
+    migration = QueueMigration(island, inbox, outboxes)
+    migration.setMigrationRate(config.migration_interval)
+    migration.setNumIndividuals(config.migration_size)
+    migration.setNumReplacement(config.migration_size)
+    ga.setMigrationAdapter(migration)
+
+    best = ga.evolve()
+    results.put((island, best, migration.sent, migration.received, fitness_cache.entries.items()))
+
+
+def evolve_islands(count=None, topology=None, seed=None, evaluator=island_evaluator):
+    """
+    модель островов: count независимых популяций в отдельных процессах
+    с миграцией лучших особей по топологии topology
+    (по умолчанию config.islands и config.island_topology)
+    генерация и отбор выполняются на всех ядрах, оценка на оборудовании
+    согласуется через блокировки parallel.device_scheduler
+    оценки островов добавляются в кэш оценок процесса и сохраняются
+    возвращает лучшие особи островов в порядке номеров островов
+    """
+
+    count = count or config.islands
+    neighbours = topologies[topology or config.island_topology]
+    rng = random.Random(seed)
+    inboxes = [multiprocessing.Queue() for i in xrange(count)]
+    results = multiprocessing.Queue()
+
+    processes = []
+    for island in xrange(count):
+        outboxes = [inboxes[i] for i in neighbours(island, count)]
+        processes.append(multiprocessing.Process(target=run_island, args=(
+            island, rng.randint(0, MAX_SEED), inboxes[island], outboxes, results, evaluator)))
+    for process in processes:
+        process.start()
+
+    # результаты читаются до join: иначе процесс с непрочитанными данными в очереди не завершится
+    best = [None] * count
+    try:
+        for i in xrange(count):
+            while True:
+                try:
+                    island, genome, sent, received, entries = results.get(timeout=ISLAND_POLL)
+                    break
+                except Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError('Island processes exited without results')
+            log.info('island %d: best score %s, migrants sent %d, received %d', island, genome.score, sent, received)
+            best[island] = genome
+            fitness_cache.merge(entries)
+    finally:
+        for process in processes:
+            process.join()
+    fitness_cache.flush()
+    return best
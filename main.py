@@ -1,20 +1,42 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import random
+
+import numpy
 import pyevolve
 from pyevolve import GSimpleGA
 from pyevolve import Selectors
 from pyevolve import DBAdapters
 
+import config
+import islands
+import parallel
+import surrogate
+from fitness_cache import fitness_cache
 from genetic_engine import network_initializer
 
 pyevolve.logEnable()
-genome = network_initializer(None)
-ga = GSimpleGA.GSimpleGA(genome)
-ga.selector.set(Selectors.GRouletteWheel)
-ga.setGenerations(10)
-ga.setPopulationSize(4)
-ga.terminationCriteria.set(GSimpleGA.ConvergenceCriteria)
-csv_adapter = DBAdapters.DBFileCSV(identify="run1", filename="stats.csv")
-ga.setDBAdapter(csv_adapter)
-ga.evolve(freq_stats=3)
-print ga.bestIndividual()
+if config.seed is not None:
+    # pyevolve выбирает особи через модуль random, особи получают зерна из него же
+    random.seed(config.seed)
+    numpy.random.seed(config.seed)
+if config.islands > 1:
+    # лучшая особь всех островов
+    print max(islands.evolve_islands(seed=config.seed), key=lambda g: g.score)
+else:
+    genome = network_initializer(None)
+    ga = GSimpleGA.GSimpleGA(genome)
+    ga.selector.set(Selectors.GRouletteWheel)
+    ga.setGenerations(config.generations)
+    ga.setPopulationSize(config.population_size)
+    if config.surrogate_top_k:
+        surrogate.install(ga)
+    elif config.parallel_evaluation:
+        parallel.install(ga)
+    ga.terminationCriteria.set(GSimpleGA.ConvergenceCriteria)
+    csv_adapter = DBAdapters.DBFileCSV(identify="run1", filename="stats.csv")
+    ga.setDBAdapter(csv_adapter)
+    ga.evolve(freq_stats=3)
+    fitness_cache.flush()
+    print ga.bestIndividual()
+    print fitness_cache.stats()
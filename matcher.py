@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from capture import IP_OFFSET
+from raw_packets import IP_PROTO_TCP, IP_PROTO_UDP, IP_PROTO_ICMP, UDP_HEADER, PAYLOAD_PREFIX_SIZE, \
+    icmp_header_length
+
+# веса составляющих оценки (потери и нарушения порядка - доли пакетов, задержка - в мс)
+DEFAULT_WEIGHTS = {'loss': 100.0, 'reordering': 10.0, 'duplication': 10.0, 'latency': 1.0}
+
+
+def frame_prefix(frame, ip_offset=0):
+    """
+    уникальный префикс полезной нагрузки пакета без разбора scapy
+    (см. raw_packets.PayloadPool), None если у пакета нет нагрузки
+    frame     - IP-пакет или кадр, в котором IP-заголовок начинается с ip_offset
+    """
+
+    ihl = (ord(frame[ip_offset]) & 0x0f) * 4
+    proto = ord(frame[ip_offset + 9])
+    l4_offset = ip_offset + ihl
+    if proto == IP_PROTO_TCP:
+        offset = l4_offset + (ord(frame[l4_offset + 12]) >> 4) * 4
+    elif proto == IP_PROTO_UDP:
+        offset = l4_offset + UDP_HEADER.size
+    elif proto == IP_PROTO_ICMP:
+        offset = l4_offset + icmp_header_length(ord(frame[l4_offset]))
+    else:
+        return None
+    prefix = frame[offset:offset + PAYLOAD_PREFIX_SIZE]
+    if len(prefix) < PAYLOAD_PREFIX_SIZE:
+        return None
+    return prefix.tobytes() if isinstance(prefix, memoryview) else prefix
+
+
+# =============================================================================
+
+
+class MatchStats(object):
+    """
+    итог сопоставления отправленных и принятых пакетов одной стороны
+    """
+
+    def __init__(self, sent, received, matched, duplicates, reordered, unknown, latency_sum, latency_max):
+        self.sent = sent
+        self.received = received
+        self.matched = matched
+        self.duplicates = duplicates
+        self.reordered = reordered
+        self.unknown = unknown
+        self.latency_sum = latency_sum
+        self.latency_max = latency_max
+
+    @property
+    def lost(self):
+        return self.sent - self.matched
+
+    @property
+    def mean_latency(self):
+        return self.latency_sum / self.matched if self.matched else 0.0
+
+    def metrics(self):
+        """
+        составляющие оценки: доли потерянных, переупорядоченных и
+        продублированных пакетов и средняя задержка в мс
+        """
+
+        sent = float(self.sent) if self.sent else 1.0
+        return {'loss': self.lost / sent,
+                'reordering': self.reordered / sent,
+                'duplication': self.duplicates / sent,
+                'latency': self.mean_latency * 1000}
+
+    def fitness(self, weights=None):
+        weights = weights or DEFAULT_WEIGHTS
+        metrics = self.metrics()
+        return sum(weights[k] * metrics[k] for k in weights)
+
+    def __repr__(self):
+        return 'sent: {0}, received: {1}, lost: {2}, duplicates: {3}, reordered: {4}, unknown: {5}, ' \
+               'latency: {6:.6f}s mean, {7:.6f}s max'.format(self.sent, self.received, self.lost, self.duplicates,
+                                                             self.reordered, self.unknown, self.mean_latency,
+                                                             self.latency_max)
+
+
+class PacketMatcher(object):
+    """
+    потоковое сопоставление отправленных и принятых пакетов одной стороны
+    через хэш-индекс по уникальному префиксу нагрузки: каждый пакет
+    обрабатывается за O(1), весь тест - за O(n)
+    отправка и прием могут регистрироваться из разных потоков
+    пакет регистрируется при постановке в очередь передатчика (on_sent без
+    времени), а время отправки записывается после отправки его пачки (stamp):
+    пакет, принятый раньше, не считается чужим, а его задержка учитывается при stamp
+    >>> m = PacketMatcher()
+    >>> for i, prefix in enumerate('abcd'):
+    ...     m.on_sent(prefix, 10.0 + i)
+    >>> for prefix in 'acbb':
+    ...     m.on_received(prefix, 20.0)
+    >>> s = m.stats()
+    >>> (s.lost, s.duplicates, s.reordered, s.mean_latency)
+    (1, 1, 1, 9.0)
+    >>> m = PacketMatcher()
+    >>> m.on_sent('e')
+    >>> m.on_received('e', 30.5)
+    >>> m.stamp('e', 30.0)
+    >>> s = m.stats()
+    >>> (s.lost, s.unknown, s.mean_latency)
+    (0, 0, 0.5)
+    """
+
+    def __init__(self):
+        # префикс -> [порядковый номер отправки, время отправки или None до stamp]
+        self.index = {}
+        # префикс -> время приема пакетов, принятых до записи времени их отправки
+        self.unstamped = {}
+        self.lock = threading.Lock()
+        # префиксы уже принятых пакетов
+        self.seen = set()
+        self.sent = 0
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.unknown = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.last_number = -1
+
+    def on_sent(self, prefix, t=None):
+        with self.lock:
+            self.index[prefix] = [self.sent, t]
+            self.sent += 1
+
+    def stamp(self, prefix, t):
+        """
+        запись времени отправки пакета, зарегистрированного on_sent без времени
+        """
+
+        with self.lock:
+            sent = self.index.get(prefix)
+            if sent is not None:
+                sent[1] = t
+                return
+            received = self.unstamped.pop(prefix, None)
+            if received is not None:
+                # пакет принят до возврата из системного вызова отправки
+                self.add_latency(max(received - t, 0.0))
+
+    def on_received(self, prefix, t):
+        with self.lock:
+            self.received += 1
+            if prefix in self.seen:
+                self.duplicates += 1
+                return
+            sent = self.index.pop(prefix, None)
+            if sent is None:
+                self.unknown += 1
+                return
+            self.seen.add(prefix)
+            number, sent_time = sent
+            # пакет отправлен раньше уже принятого
+            if number < self.last_number:
+                self.reordered += 1
+            else:
+                self.last_number = number
+            if sent_time is None:
+                self.unstamped[prefix] = t
+            else:
+                self.add_latency(t - sent_time)
+
+    def add_latency(self, latency):
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def on_frame(self, t, frame):
+        """
+        обработчик кадров захвата (см. capture.Capture.capture)
+        """
+
+        prefix = frame_prefix(frame, IP_OFFSET)
+        if prefix is not None:
+            self.on_received(prefix, t)
+
+    def stats(self):
+        return MatchStats(self.sent, self.received, self.sent - len(self.index), self.duplicates, self.reordered,
+                          self.unknown, self.latency_sum, self.latency_max)
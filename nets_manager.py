@@ -23,6 +23,8 @@ class Translator:
     'r'
     >>> t.ip2pos[t.node2ip[0]]
     'l'
+    >>> [(Translator.int2ip(a), m) for a, m in t.prefixes('r')]
+    [('128.0.1.0', 24)]
     """
 
     def __init__(self, nets, nodes):
@@ -30,6 +32,8 @@ class Translator:
         self.node2ip = []
         self.node2pos = []
         self.ip2pos = {}
+        # адреса сетей: (адрес, длина маски, положение)
+        self.net_prefixes = []
 
         net_counts = {}
         for k in masks:
@@ -47,6 +51,7 @@ class Translator:
                 raise ValueError('Too many nets({0}) to such mask: {1}'.format(net_counts[mask], mask))
             net_addrs.append(net_addr | (net_counts[mask] << node_bytes))
             node_counts.append(0)
+            self.net_prefixes.append((net_addrs[-1], mask, nets[i][1]))
 
         for i in xrange(len(nodes)):
             net = nodes[i]
@@ -61,6 +66,12 @@ class Translator:
 
     # -------------------------------------------------------------------------
 
+    def prefixes(self, pos):
+        """
+        адреса и длины масок сетей, расположенных с заданной стороны
+        """
+        return [(addr, mask) for addr, mask, p in self.net_prefixes if p == pos]
+
     @staticmethod
     def int2ip(addr):
         return socket.inet_ntoa(struct.pack("!I", addr))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from contextlib import contextmanager
+
+from pyevolve import GPopulation
+
+import config
+from fitness_cache import fitness_cache
+import transmitter
+from flow import payload_pool
+
+
+class DeviceScheduler(object):
+    """
+    распределение устройств под тестом между рабочими процессами
+    pairs - пары (интерфейсы отправки, интерфейсы захвата) сторон, см. config.worker_ifaces
+    каждый процесс закрепляется за парой по номеру, на время отправки и захвата
+    пара блокируется: с одной парой (общий коммутатор) доступ к устройству
+    сериализуется, а при своей паре у каждого процесса процессы не ждут друг друга
+    объект создается до запуска пула, блокировки и счетчик наследуются при fork
+    """
+
+    def __init__(self, pairs):
+        if not pairs:
+            raise ValueError('No interface pairs')
+        self.pairs = pairs
+        self.locks = [multiprocessing.Lock() for pair in pairs]
+        self.counter = multiprocessing.Value('i', 0)
+        # родительский процесс использует первую пару
+        self.slot = 0
+
+    def assign_slot(self):
+        """
+        закрепление текущего процесса за очередной парой интерфейсов
+        """
+
+        with self.counter.get_lock():
+            self.slot = self.counter.value % len(self.pairs)
+            self.counter.value += 1
+        return self.slot
+
+    @contextmanager
+    def device(self):
+        """
+        монопольное использование пары интерфейсов текущего процесса
+        """
+
+        with self.locks[self.slot]:
+            yield self.pairs[self.slot]
+
+
+device_scheduler = DeviceScheduler(config.worker_ifaces)
+
+
+def init_worker():
+    """
+    подготовка рабочего процесса: состояние, унаследованное от родителя
+    при fork, заменяется собственным
+    """
+
+    # иначе префиксы нагрузки разных процессов совпадут
+    payload_pool.reset()
+    # сокеты и буферы передатчиков родителя не используются
+    transmitter.transmitters.clear()
+    device_scheduler.assign_slot()
+
+
+class CachedPool(object):
+    """
+    пул, передающий в рабочие процессы только особи, оценок которых
+    нет в кэше родительского процесса (см. fitness_cache)
+    pyevolve вызывает map(функция оценки, особи) и ждет список оценок
+    """
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+
+    def map(self, func, genomes):
+        keys = [g.content_hash() for g in genomes]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        known = [score for score in scores if score is not None]
+        results = self.evaluate(func, [genomes[i] for i in missing], [keys[i] for i in missing], known)
+        for i, score in zip(missing, results):
+            scores[i] = score
+        # map вызывается один раз за поколение
+        self.cache.flush()
+        return scores
+
+    def evaluate(self, func, genomes, keys, known=()):
+        """
+        оценка особей, которых нет в кэше, с сохранением оценок в кэш
+        known - оценки остальных особей поколения, найденные в кэше
+        """
+        scores = self.pool.map(func, genomes, chunksize=1)
+        for key, score in zip(keys, scores):
+            self.cache.put(key, score)
+        return scores
+
+    def terminate(self):
+        self.pool.terminate()
+
+
+class SerialPool(object):
+    """
+    пул без процессов: оценка в текущем процессе через тот же интерфейс map
+    """
+
+    def map(self, func, items, chunksize=None):
+        return map(func, items)
+
+    def terminate(self):
+        pass
+
+
+def process_pool(processes=None):
+    """
+    постоянный пул рабочих процессов оценки
+    """
+    return multiprocessing.Pool(processes or config.eval_processes, initializer=init_worker)
+
+
+def install(ga, processes=None):
+    """
+    параллельная оценка популяции ga в постоянном пуле процессов
+    в процессы передаются особи, обратно - только их оценки
+    """
+
+    return install_pool(ga, CachedPool(process_pool(processes), fitness_cache))
+
+
+def install_pool(ga, pool):
+    """
+    оценка популяции ga через pool.map
+    pyevolve создает пул при оценке каждого поколения и не закрывает его,
+    поэтому фабрика пула модуля GPopulation заменяется на постоянный пул
+    """
+
+    GPopulation.Pool = lambda: pool
+    # на одноядерной машине pyevolve отключает пул, но процессы нужны и там:
+    # пока один процесс занимает устройство, остальные генерируют пакеты
+    GPopulation.MULTI_PROCESSING = True
+    ga.setMultiProcessing(True, full_copy=False)
+    return pool
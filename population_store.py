@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from flow import FlowICMP, FlowTCP, FlowUDP
+from fx import FTP, FLP, FTTL, FTF, FFlow, FHF
+from nets_manager import directions
+from genetic_engine import NetworkGenome
+
+# типы потоков, номер типа хранится в flow_kinds (порядок как в random_flow)
+FLOW_CLASSES = (FlowICMP, FlowTCP, FlowUDP)
+# классы ФРВ потока в порядке Flow.fxs
+FLOW_FX_CLASSES = (FTP, FLP, FTTL, FTP, FLP, FTTL, FTF, FHF)
+# ФРВ особи: FFlow, затем по len(FLOW_FX_CLASSES) ФРВ каждого потока
+FLOW_FX_COUNT = len(FLOW_FX_CLASSES)
+
+
+def segments(offsets, indices):
+    """
+    индексы элементов отрезков [offsets[i], offsets[i + 1]) для i из indices
+    подряд и смещения отрезков в результате
+    >>> flat, new_offsets = segments(numpy.array([0, 2, 5, 6]), numpy.array([1, 0, 1]))
+    >>> flat.tolist(), new_offsets.tolist()
+    ([2, 3, 4, 0, 1, 2, 3, 4], [0, 3, 5, 8])
+    """
+
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    new_offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=new_offsets[1:])
+    flat = numpy.arange(new_offsets[-1], dtype=numpy.int64) + numpy.repeat(starts - new_offsets[:-1], lengths)
+    return flat, new_offsets
+
+
+def first_seen(keys):
+    """
+    номера ключей в порядке их первого появления и сами ключи в этом порядке
+    (так узлы и сети нумерует translate_nodes_and_nets)
+    >>> numbers, unique = first_seen(numpy.array([7, 3, 7, 5]))
+    >>> numbers.tolist(), unique.tolist()
+    ([0, 1, 0, 2], [7, 3, 5])
+    """
+
+    unique, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    rank = numpy.empty(len(order), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(order))
+    return rank[inverse], unique[order]
+
+
+class PopulationStore(object):
+    """
+    популяция NetworkGenome в виде структуры массивов numpy: записи всех
+    особей лежат подряд в общих массивах, границы особей задаются смещениями
+    клонирование и кроссовер - копирование отрезков массивов без создания
+    объектов потоков и ФРВ; объекты строятся только при распаковке (genome)
+
+    особи:  texp, seeds, fflow_fx и смещения net_offsets, node_offsets, flow_offsets, fx_offsets
+    сети:   net_masks, net_directions (индекс в nets_manager.directions)
+    узлы:   node_nets - номер сети внутри особи
+    потоки: flow_kinds (индекс в FLOW_CLASSES), flow_nodes, flow_params (порты или типы ICMP), flow_seeds
+    ФРВ:    fx_offsets_points - смещения точек, fx_probabilities, fx_values
+    """
+
+    def __init__(self, texp, seeds, net_offsets, net_masks, net_directions, node_offsets, node_nets, flow_offsets,
+                 flow_kinds, flow_nodes, flow_params, flow_seeds, fx_offsets, fx_points_offsets, fx_probabilities,
+                 fx_values):
+        self.texp = texp
+        self.seeds = seeds
+        self.net_offsets = net_offsets
+        self.net_masks = net_masks
+        self.net_directions = net_directions
+        self.node_offsets = node_offsets
+        self.node_nets = node_nets
+        self.flow_offsets = flow_offsets
+        self.flow_kinds = flow_kinds
+        self.flow_nodes = flow_nodes
+        self.flow_params = flow_params
+        self.flow_seeds = flow_seeds
+        self.fx_offsets = fx_offsets
+        self.fx_points_offsets = fx_points_offsets
+        self.fx_probabilities = fx_probabilities
+        self.fx_values = fx_values
+
+    def __len__(self):
+        return len(self.texp)
+
+    @property
+    def nbytes(self):
+        """
+        объем массивов популяции в байтах
+        """
+        return sum(a.nbytes for a in self.__dict__.values())
+
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def pack(cls, genomes):
+        """
+        упаковка списка геномов в массивы
+        """
+
+        texp, seeds = [], []
+        net_counts, net_masks, net_directions = [], [], []
+        node_counts, node_nets = [], []
+        flow_counts, flow_kinds, flow_nodes, flow_params, flow_seeds = [], [], [], [], []
+        fx_counts, point_counts, probabilities, values = [], [], [], []
+
+        for g in genomes:
+            texp.append(g.texp)
+            seeds.append(g.seed)
+            net_counts.append(len(g.nets))
+            for mask, direction in g.nets:
+                net_masks.append(mask)
+                net_directions.append(directions.index(direction))
+            node_counts.append(len(g.nodes))
+            node_nets += g.nodes
+            flow_counts.append(len(g.flows))
+            fx_counts.append(1 + FLOW_FX_COUNT * len(g.flows))
+            fxs = [g.fflow]
+            for f in g.flows:
+                flow_kinds.append(FLOW_CLASSES.index(type(f)))
+                flow_nodes.append((f.node1, f.node2))
+                flow_params.append((f.type1, f.type2) if isinstance(f, FlowICMP) else (f.port1, f.port2))
+                flow_seeds.append(f.seed)
+                fxs += f.fxs
+            for fx in fxs:
+                point_counts.append(len(fx.probabilities))
+                probabilities += fx.probabilities
+                values += fx.values
+
+        return cls(numpy.array(texp, dtype=numpy.float64),
+                   numpy.array(seeds, dtype=numpy.int64),
+                   cls.offsets(net_counts),
+                   numpy.array(net_masks, dtype=numpy.uint8),
+                   numpy.array(net_directions, dtype=numpy.uint8),
+                   cls.offsets(node_counts),
+                   numpy.array(node_nets, dtype=numpy.int32),
+                   cls.offsets(flow_counts),
+                   numpy.array(flow_kinds, dtype=numpy.uint8),
+                   numpy.array(flow_nodes, dtype=numpy.int32).reshape(-1, 2),
+                   numpy.array(flow_params, dtype=numpy.int32).reshape(-1, 2),
+                   numpy.array(flow_seeds, dtype=numpy.int64),
+                   cls.offsets(fx_counts),
+                   cls.offsets(point_counts),
+                   numpy.array(probabilities, dtype=numpy.float64),
+                   numpy.array(values, dtype=numpy.float64))
+
+    @staticmethod
+    def offsets(counts):
+        result = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=result[1:])
+        return result
+
+    def genome(self, i):
+        """
+        распаковка i-й особи в NetworkGenome
+        """
+
+        nets_from, nets_to = self.net_offsets[i], self.net_offsets[i + 1]
+        nets = zip(self.net_masks[nets_from:nets_to].tolist(),
+                   [directions[d] for d in self.net_directions[nets_from:nets_to]])
+        nodes = self.node_nets[self.node_offsets[i]:self.node_offsets[i + 1]].tolist()
+
+        fx_from = self.fx_offsets[i]
+        fflow = self.fx(FFlow, fx_from)
+        flows = []
+        for n, k in enumerate(xrange(self.flow_offsets[i], self.flow_offsets[i + 1])):
+            first = fx_from + 1 + FLOW_FX_COUNT * n
+            fxs = [self.fx(fx_cls, first + j) for j, fx_cls in enumerate(FLOW_FX_CLASSES)]
+            param1, param2 = self.flow_params[k].tolist()
+            node1, node2 = self.flow_nodes[k].tolist()
+            flow = FLOW_CLASSES[self.flow_kinds[k]](param1, param2, node1, node2, *fxs)
+            flow.seed = int(self.flow_seeds[k])
+            flows.append(flow)
+
+        return NetworkGenome(nets, nodes, flows, fflow, float(self.texp[i]), int(self.seeds[i]))
+
+    def genomes(self):
+        return [self.genome(i) for i in xrange(len(self))]
+
+    def fx(self, fx_cls, k):
+        """
+        ФРВ класса fx_cls по k-й записи таблицы ФРВ
+        """
+
+        points_from, points_to = self.fx_points_offsets[k], self.fx_points_offsets[k + 1]
+        fx = fx_cls()
+        values = self.fx_values[points_from:points_to]
+        fx.points = zip(self.fx_probabilities[points_from:points_to].tolist(),
+                        (values.astype(numpy.int64) if fx.v_type == int else values).tolist())
+        return fx
+
+    # -------------------------------------------------------------------------
+
+    def take(self, indices):
+        """
+        новая популяция из особей с номерами indices (номера могут повторяться):
+        клонирование и отбор без распаковки особей
+        """
+
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        nets, net_offsets = segments(self.net_offsets, indices)
+        nodes, node_offsets = segments(self.node_offsets, indices)
+        flows, flow_offsets = segments(self.flow_offsets, indices)
+        fxs, fx_offsets = segments(self.fx_offsets, indices)
+        points, fx_points_offsets = segments(self.fx_points_offsets, fxs)
+
+        return PopulationStore(self.texp[indices], self.seeds[indices],
+                               net_offsets, self.net_masks[nets], self.net_directions[nets],
+                               node_offsets, self.node_nets[nodes],
+                               flow_offsets, self.flow_kinds[flows], self.flow_nodes[flows], self.flow_params[flows],
+                               self.flow_seeds[flows],
+                               fx_offsets, fx_points_offsets, self.fx_probabilities[points], self.fx_values[points])
+
+    def crossover(self, mom, dad, cross):
+        """
+        одноточечный кроссовер потоков особей mom и dad (см. network_crossover):
+        потомок получает потоки mom до cross и потоки dad начиная с cross,
+        узлы и сети этих потоков перенумеровываются в порядке первого
+        использования, как в translate_nodes_and_nets; texp, FFlow и зерно
+        берутся от mom. Возвращает популяцию из одного потомка
+        """
+
+        mom_flows = numpy.arange(self.flow_offsets[mom], min(self.flow_offsets[mom] + cross,
+                                                             self.flow_offsets[mom + 1]))
+        dad_flows = numpy.arange(min(self.flow_offsets[dad] + cross, self.flow_offsets[dad + 1]),
+                                 self.flow_offsets[dad + 1])
+        flows = numpy.concatenate((mom_flows, dad_flows))
+        if not len(flows):
+            raise ValueError('No flows in offspring')
+        parents = numpy.repeat(numpy.array([mom, dad], dtype=numpy.int64), (len(mom_flows), len(dad_flows)))
+
+        # узлы и сети нумеруются по общим таблицам популяции
+        flow_nodes, nodes = first_seen((self.flow_nodes[flows] + self.node_offsets[parents][:, None]).ravel())
+        node_nets, nets = first_seen(self.node_nets[nodes] + self.net_offsets[self.node_owner(nodes)])
+
+        # ФРВ потомка: FFlow матери и ФРВ выбранных потоков
+        flow_index = flows - self.flow_offsets[parents]
+        flow_fxs = (self.fx_offsets[parents] + 1 + FLOW_FX_COUNT * flow_index)[:, None] + numpy.arange(FLOW_FX_COUNT)
+        fxs = numpy.concatenate(([self.fx_offsets[mom]], flow_fxs.ravel()))
+        points, fx_points_offsets = segments(self.fx_points_offsets, fxs)
+
+        return PopulationStore(self.texp[[mom]], self.seeds[[mom]],
+                               self.offsets([len(nets)]), self.net_masks[nets], self.net_directions[nets],
+                               self.offsets([len(nodes)]), node_nets.astype(numpy.int32),
+                               self.offsets([len(flows)]), self.flow_kinds[flows],
+                               flow_nodes.reshape(-1, 2).astype(numpy.int32), self.flow_params[flows],
+                               self.flow_seeds[flows],
+                               self.offsets([len(fxs)]), fx_points_offsets, self.fx_probabilities[points],
+                               self.fx_values[points])
+
+    def node_owner(self, nodes):
+        """
+        номера особей, которым принадлежат узлы с номерами nodes общей таблицы
+        """
+        return numpy.searchsorted(self.node_offsets, nodes, side='right') - 1
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        объединение популяций (например, потомков, полученных crossover)
+        """
+
+        def shifted(name):
+            shift = 0
+            parts = [numpy.zeros(1, dtype=numpy.int64)]
+            for s in stores:
+                offsets = getattr(s, name)
+                parts.append(offsets[1:] + shift)
+                shift += offsets[-1]
+            return numpy.concatenate(parts)
+
+        def joined(name):
+            return numpy.concatenate([getattr(s, name) for s in stores])
+
+        return cls(joined('texp'), joined('seeds'),
+                   shifted('net_offsets'), joined('net_masks'), joined('net_directions'),
+                   shifted('node_offsets'), joined('node_nets'),
+                   shifted('flow_offsets'), joined('flow_kinds'), joined('flow_nodes'), joined('flow_params'),
+                   joined('flow_seeds'),
+                   shifted('fx_offsets'), shifted('fx_points_offsets'), joined('fx_probabilities'),
+                   joined('fx_values'))
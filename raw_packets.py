@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import array
+import itertools
+import struct
+import sys
+import time
+import uuid
+
+# максимальный размер IP-пакета
+MAX_PACKET_SIZE = 2 ** 16 - 1
+# размер буфера шаблона: пакеты потоков не превышают MTU Ethernet
+TEMPLATE_SIZE = 2048
+# длина уникального префикса полезной нагрузки (как у строкового uuid)
+PAYLOAD_PREFIX_SIZE = 36
+
+IP_PROTO_ICMP = 1
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+TCP_HEADER = struct.Struct('!HHIIBBHHH')
+UDP_HEADER = struct.Struct('!HHHH')
+ICMP_HEADER = struct.Struct('!BBHHH')
+PSEUDO_HEADER = struct.Struct('!4s4sBBH')
+CHECKSUM = struct.Struct('!H')
+
+# значения полей по умолчанию, совпадающие с scapy
+IP_ID = 1
+TCP_WINDOW = 8192
+# смещение заголовка транспортного уровня (IP без опций)
+L4_OFFSET = IP_HEADER.size
+# изменяемые поля заголовков в шаблонах
+TCP_VARIABLE = struct.Struct('!IIBB')
+TTL = struct.Struct('!B')
+
+# типы ICMP, у которых в заголовке есть поля id и seq
+ICMP_ID_SEQ_TYPES = (0, 8, 13, 14, 15, 16, 17, 18)
+# типы ICMP с дополнительными полями: метки времени и маска адреса
+ICMP_TIMESTAMP_TYPES = (13, 14)
+ICMP_ADDR_MASK_TYPES = (17, 18)
+
+
+# =============================================================================
+
+
+def checksum_partial(data, initial=0):
+    """
+    несвернутая сумма 16-битных слов данных (в сетевом порядке байт),
+    позволяет считать контрольную сумму по частям
+    >>> checksum_fold(checksum_partial('\\x45\\x00') + checksum_partial('\\x00\\x1c'))
+    47843
+    """
+
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if len(data) % 2:
+        data = bytes(data) + '\x00'
+    words = array.array('H', bytes(data))
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return initial + sum(words)
+
+
+def checksum_fold(partial):
+    """
+    свертка суммы в 16-битную контрольную сумму (дополнение до единицы)
+    """
+
+    while partial >> 16:
+        partial = (partial & 0xffff) + (partial >> 16)
+    return ~partial & 0xffff
+
+
+def checksum(data):
+    """
+    контрольная сумма интернета (RFC 1071)
+    >>> checksum('\\x45\\x00\\x00\\x1c')
+    47843
+    """
+
+    return checksum_fold(checksum_partial(data))
+
+
+def checksum_update(hc, old, new):
+    """
+    инкрементальное обновление контрольной суммы hc
+    при замене 16-битного слова old на new (RFC 1624, eqn. 3)
+    >>> hc = checksum('\\x45\\x00\\x00\\x1c')
+    >>> checksum_update(hc, 0x001c, 0x0030) == checksum('\\x45\\x00\\x00\\x30')
+    True
+    """
+
+    return checksum_fold((~hc & 0xffff) + (~old & 0xffff) + new)
+
+
+def icmp_header_length(icmp_type):
+    """
+    длина заголовка ICMP заданного типа
+    """
+
+    if icmp_type in ICMP_TIMESTAMP_TYPES:
+        return ICMP_HEADER.size + 12
+    if icmp_type in ICMP_ADDR_MASK_TYPES:
+        return ICMP_HEADER.size + 4
+    return ICMP_HEADER.size
+
+
+# =============================================================================
+
+
+class RawPacketBuilder(object):
+    """
+    построитель IP-пакетов напрямую в байтах, без составления уровней scapy
+    пакеты записываются в заранее выделенный буфер, каждый метод возвращает
+    memoryview готового пакета, действительный до следующего вызова построителя
+    адреса передаются в упакованном виде (socket.inet_aton)
+    >>> b = RawPacketBuilder()
+    >>> str(b.udp('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 1, 2, 3, 'AB').tobytes()).encode('hex')
+    '4500001e000100000311a7bb010203040506070800010002000aae814142'
+    """
+
+    def __init__(self, size=MAX_PACKET_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def __ip(self, src, dst, proto, ttl, length):
+        """
+        заголовок IPv4 с контрольной суммой
+        """
+
+        IP_HEADER.pack_into(self.buffer, 0, 0x45, 0, length, IP_ID, 0, ttl, proto, 0, src, dst)
+        CHECKSUM.pack_into(self.buffer, 10, checksum(self.view[:IP_HEADER.size]))
+
+    def __payload(self, offset, payload):
+        end = offset + len(payload)
+        self.buffer[offset:end] = payload
+        return end
+
+    def __l4_checksum(self, src, dst, proto, offset, end):
+        """
+        контрольная сумма транспортного уровня с псевдозаголовком
+        """
+
+        pseudo = checksum_partial(PSEUDO_HEADER.pack(src, dst, 0, proto, end - offset))
+        return checksum_fold(checksum_partial(self.view[offset:end], pseudo))
+
+    def tcp(self, src, dst, sport, dport, seq, ack, flags, ttl, payload=''):
+        offset = IP_HEADER.size
+        end = self.__payload(offset + TCP_HEADER.size, payload)
+        TCP_HEADER.pack_into(self.buffer, offset, sport, dport, seq, ack, 5 << 4, flags, TCP_WINDOW, 0, 0)
+        CHECKSUM.pack_into(self.buffer, offset + 16, self.__l4_checksum(src, dst, IP_PROTO_TCP, offset, end))
+        self.__ip(src, dst, IP_PROTO_TCP, ttl, end)
+        return self.view[:end]
+
+    def udp(self, src, dst, sport, dport, ttl, payload=''):
+        offset = IP_HEADER.size
+        end = self.__payload(offset + UDP_HEADER.size, payload)
+        UDP_HEADER.pack_into(self.buffer, offset, sport, dport, end - offset, 0)
+        # нулевая сумма в UDP означает ее отсутствие
+        CHECKSUM.pack_into(self.buffer, offset + 6, self.__l4_checksum(src, dst, IP_PROTO_UDP, offset, end) or 0xffff)
+        self.__ip(src, dst, IP_PROTO_UDP, ttl, end)
+        return self.view[:end]
+
+    def icmp(self, src, dst, icmp_type, seq, ttl, payload=''):
+        offset = IP_HEADER.size
+        header_length = icmp_header_length(icmp_type)
+        end = self.__payload(offset + header_length, payload)
+        if icmp_type not in ICMP_ID_SEQ_TYPES:
+            seq = 0
+        ICMP_HEADER.pack_into(self.buffer, offset, icmp_type, 0, 0, 0, seq)
+        if icmp_type in ICMP_TIMESTAMP_TYPES:
+            # как и scapy, метки времени - миллисекунды от начала суток
+            ts = int((time.time() % (24 * 60 * 60)) * 1000)
+            struct.pack_into('!III', self.buffer, offset + ICMP_HEADER.size, ts, ts, ts)
+        elif icmp_type in ICMP_ADDR_MASK_TYPES:
+            struct.pack_into('!I', self.buffer, offset + ICMP_HEADER.size, 0)
+        CHECKSUM.pack_into(self.buffer, offset + 2, checksum(self.view[offset:end]))
+        self.__ip(src, dst, IP_PROTO_ICMP, ttl, end)
+        return self.view[:end]
+
+
+# =============================================================================
+
+
+class HeaderTemplate(object):
+    """
+    шаблон заголовков одного направления потока: адреса, порты и протокол
+    сериализуются один раз, для каждого пакета дописываются только изменяемые
+    поля, контрольная сумма IP обновляется инкрементально (RFC 1624),
+    а сумма транспортного уровня - от заранее посчитанной суммы шаблона
+    build() возвращает memoryview пакета, действительный до следующего вызова;
+    нагрузка передается префиксом и телом, для тела можно передать
+    заранее посчитанную сумму (см. PayloadPool)
+    """
+
+    proto = None
+    l4_size = 0
+
+    def __init__(self, src, dst, size=TEMPLATE_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.payload_offset = L4_OFFSET + self.l4_size
+        IP_HEADER.pack_into(self.buffer, 0, 0x45, 0, self.payload_offset, IP_ID, 0, 0, self.proto, 0, src, dst)
+        self.ip_checksum = checksum(self.view[:L4_OFFSET])
+        # псевдозаголовок без длины
+        self.pseudo = checksum_partial(PSEUDO_HEADER.pack(src, dst, 0, self.proto, 0))
+        self.l4_sum = 0
+
+    def _payload(self, payload, prefix):
+        """
+        запись нагрузки: префикс (четной длины), затем тело
+        """
+
+        start = self.payload_offset + len(prefix)
+        self.buffer[self.payload_offset:start] = prefix
+        end = start + len(payload)
+        self.buffer[start:end] = payload
+        return end
+
+    @staticmethod
+    def _payload_sum(payload, prefix, payload_sum, initial):
+        """
+        несвернутая сумма нагрузки; payload_sum - заранее известная сумма тела
+        """
+
+        if payload_sum is None:
+            payload_sum = checksum_partial(payload)
+        return checksum_partial(prefix, initial + payload_sum)
+
+    def _ip(self, ttl, end):
+        hc = checksum_update(self.ip_checksum, self.payload_offset, end)
+        hc = checksum_update(hc, self.proto, (ttl << 8) | self.proto)
+        CHECKSUM.pack_into(self.buffer, 2, end)
+        TTL.pack_into(self.buffer, 8, ttl)
+        CHECKSUM.pack_into(self.buffer, 10, hc)
+        return self.view[:end]
+
+
+class TCPTemplate(HeaderTemplate):
+    """
+    >>> t = TCPTemplate('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 1, 2)
+    >>> b = RawPacketBuilder()
+    >>> t.build(10, 20, 16, 3, 'AB').tobytes() == b.tcp('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 1, 2, 10, 20, 16, 3, 'AB').tobytes()
+    True
+    """
+
+    proto = IP_PROTO_TCP
+    l4_size = TCP_HEADER.size
+
+    def __init__(self, src, dst, sport, dport, size=TEMPLATE_SIZE):
+        super(TCPTemplate, self).__init__(src, dst, size)
+        TCP_HEADER.pack_into(self.buffer, L4_OFFSET, sport, dport, 0, 0, 5 << 4, 0, TCP_WINDOW, 0, 0)
+        self.l4_sum = checksum_partial(self.view[L4_OFFSET:self.payload_offset], self.pseudo)
+
+    def build(self, seq, ack, flags, ttl, payload='', prefix='', payload_sum=None):
+        end = self._payload(payload, prefix)
+        TCP_VARIABLE.pack_into(self.buffer, L4_OFFSET + 4, seq, ack, 5 << 4, flags)
+        partial = self._payload_sum(payload, prefix, payload_sum, self.l4_sum + end - L4_OFFSET +
+                                    (seq >> 16) + (seq & 0xffff) + (ack >> 16) + (ack & 0xffff) + flags)
+        CHECKSUM.pack_into(self.buffer, L4_OFFSET + 16, checksum_fold(partial))
+        return self._ip(ttl, end)
+
+
+class UDPTemplate(HeaderTemplate):
+    """
+    >>> t = UDPTemplate('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 1, 2)
+    >>> t.build(3, 'AB').tobytes() == RawPacketBuilder().udp('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 1, 2, 3, 'AB').tobytes()
+    True
+    """
+
+    proto = IP_PROTO_UDP
+    l4_size = UDP_HEADER.size
+
+    def __init__(self, src, dst, sport, dport, size=TEMPLATE_SIZE):
+        super(UDPTemplate, self).__init__(src, dst, size)
+        UDP_HEADER.pack_into(self.buffer, L4_OFFSET, sport, dport, 0, 0)
+        self.l4_sum = checksum_partial(self.view[L4_OFFSET:self.payload_offset], self.pseudo)
+
+    def build(self, ttl, payload='', prefix='', payload_sum=None):
+        end = self._payload(payload, prefix)
+        length = end - L4_OFFSET
+        CHECKSUM.pack_into(self.buffer, L4_OFFSET + 4, length)
+        # длина входит и в псевдозаголовок, и в заголовок UDP
+        partial = self._payload_sum(payload, prefix, payload_sum, self.l4_sum + 2 * length)
+        # нулевая сумма в UDP означает ее отсутствие
+        CHECKSUM.pack_into(self.buffer, L4_OFFSET + 6, checksum_fold(partial) or 0xffff)
+        return self._ip(ttl, end)
+
+
+class ICMPTemplate(HeaderTemplate):
+    """
+    >>> t = ICMPTemplate('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 8)
+    >>> t.build(5, 3, 'AB').tobytes() == RawPacketBuilder().icmp('\\x01\\x02\\x03\\x04', '\\x05\\x06\\x07\\x08', 8, 5, 3, 'AB').tobytes()
+    True
+    """
+
+    proto = IP_PROTO_ICMP
+
+    def __init__(self, src, dst, icmp_type, size=TEMPLATE_SIZE):
+        self.l4_size = icmp_header_length(icmp_type)
+        super(ICMPTemplate, self).__init__(src, dst, size)
+        self.has_seq = icmp_type in ICMP_ID_SEQ_TYPES
+        ICMP_HEADER.pack_into(self.buffer, L4_OFFSET, icmp_type, 0, 0, 0, 0)
+        if icmp_type in ICMP_TIMESTAMP_TYPES:
+            ts = int((time.time() % (24 * 60 * 60)) * 1000)
+            struct.pack_into('!III', self.buffer, L4_OFFSET + ICMP_HEADER.size, ts, ts, ts)
+        # в ICMP нет псевдозаголовка
+        self.l4_sum = checksum_partial(self.view[L4_OFFSET:self.payload_offset])
+
+    def build(self, seq, ttl, payload='', prefix='', payload_sum=None):
+        end = self._payload(payload, prefix)
+        if not self.has_seq:
+            seq = 0
+        CHECKSUM.pack_into(self.buffer, L4_OFFSET + 6, seq)
+        partial = self._payload_sum(payload, prefix, payload_sum, self.l4_sum + seq)
+        CHECKSUM.pack_into(self.buffer, L4_OFFSET + 2, checksum_fold(partial))
+        return self._ip(ttl, end)
+
+
+# =============================================================================
+
+
+class PayloadPool(object):
+    """
+    пул полезной нагрузки: тело нагрузки - срез memoryview одного общего
+    заранее заполненного буфера, а уникальность пакетов обеспечивает
+    префикс из идентификатора пула и счетчика
+    >>> pool = PayloadPool()
+    >>> body, prefix, body_sum = pool.take(5)
+    >>> len(prefix), body.tobytes()
+    (36, 'AAAAA')
+    >>> pool.take(5)[1] != prefix
+    True
+    >>> body_sum == checksum_partial(body)
+    True
+    >>> len(pool.string(100)) == PAYLOAD_PREFIX_SIZE + 100
+    True
+    """
+
+    def __init__(self, size=TEMPLATE_SIZE, fill='A'):
+        self.fill = ord(fill)
+        self.body = memoryview(fill * size)
+        self.reset()
+
+    def reset(self):
+        """
+        новый идентификатор пула; вызывается в процессе, порожденном fork,
+        иначе его префиксы повторят префиксы родителя
+        """
+
+        self.counter = itertools.count()
+        # идентификатор пула отличает нагрузку разных процессов и запусков
+        self.pool_id = uuid.uuid4().hex[:PAYLOAD_PREFIX_SIZE - 20]
+
+    def prefix(self):
+        return '%s%020d' % (self.pool_id, next(self.counter))
+
+    def body_sum(self, length):
+        """
+        несвернутая сумма тела длины length без обхода буфера
+        """
+
+        partial = (length // 2) * ((self.fill << 8) | self.fill)
+        if length % 2:
+            partial += self.fill << 8
+        return partial
+
+    def take(self, length):
+        """
+        нагрузка для быстрого пути без копирования: (тело, префикс, сумма тела),
+        порядок совпадает с аргументами build() шаблонов
+        """
+
+        return self.body[:length], self.prefix(), self.body_sum(length)
+
+    def string(self, length):
+        """
+        нагрузка одной строкой для пути scapy
+        """
+
+        return self.prefix() + self.body[:length].tobytes()
+
+    @staticmethod
+    def size(length):
+        """
+        полный размер нагрузки с телом длины length
+        """
+
+        return PAYLOAD_PREFIX_SIZE + length
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy
+
+# начальный размер порции векторной генерации пакетов
+SCHEDULE_CHUNK = 256
+
+
+class Schedule(object):
+    """
+    расписание пакетов потока в колоночном виде (без объектов scapy):
+    times      - моменты отправки пакетов (по возрастанию)
+    directions - направления (0 - от node1 к node2, 1 - от node2 к node1)
+    lengths    - длины полезной нагрузки
+    ttls       - значения TTL
+    >>> s = Schedule(numpy.array([0.0, 0.1, 0.2]), numpy.array([0, 1, 0]),
+    ...              numpy.array([100, 200, 300]), numpy.array([1, 2, 3]))
+    >>> len(s)
+    3
+    >>> s.counts()
+    (2, 1)
+    """
+
+    def __init__(self, times, directions, lengths, ttls):
+        self.times = times
+        self.directions = directions
+        self.lengths = lengths
+        self.ttls = ttls
+
+    def __len__(self):
+        return len(self.times)
+
+    def counts(self):
+        """
+        количество пакетов в каждом направлении
+        """
+        right = int(self.directions.sum())
+        return len(self) - right, right
+
+    def rows(self):
+        """
+        построчный обход расписания: (время, направление, длина, ttl)
+        """
+        return zip(self.times.tolist(), self.directions.tolist(), self.lengths.tolist(), self.ttls.tolist())
+
+
+def build_schedule(t0, t1, fhf, ftps, flps, fttls, rng=None):
+    """
+    векторная генерация расписания пакетов на промежутке [t0, t1)
+    fhf          - ФРВ направления пакета
+    ftps, flps, fttls - пары ФРВ (для направления 0, для направления 1)
+    интервал после пакета берется из ФРВ его направления
+    """
+    times = []
+    directions = []
+    t = t0
+    chunk = SCHEDULE_CHUNK
+    while t < t1:
+        d = (fhf.sample(chunk, rng) != 0).astype(numpy.int8)
+        tp = numpy.where(d == 0, ftps[0].sample(chunk, rng), ftps[1].sample(chunk, rng))
+        ts = numpy.empty(chunk)
+        ts[0] = t
+        numpy.cumsum(tp[:-1], out=ts[1:])
+        ts[1:] += t
+        # отбрасываем пакеты, выходящие за время жизни потока
+        k = numpy.searchsorted(ts, t1, side='left')
+        times.append(ts[:k])
+        directions.append(d[:k])
+        if k < chunk:
+            break
+        t = ts[-1] + tp[-1]
+        chunk *= 2
+
+    times = numpy.concatenate(times) if times else numpy.empty(0)
+    directions = numpy.concatenate(directions) if directions else numpy.empty(0, dtype=numpy.int8)
+    n = len(times)
+    lengths = numpy.where(directions == 0, flps[0].sample(n, rng), flps[1].sample(n, rng))
+    ttls = numpy.where(directions == 0, fttls[0].sample(n, rng), fttls[1].sample(n, rng))
+    return Schedule(times, directions, lengths, ttls)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy
+from pyevolve import Consts
+
+import config
+from fitness_cache import fitness_cache
+from flow import FlowICMP, FlowTCP, FlowUDP
+from parallel import CachedPool, SerialPool, process_pool, install_pool
+
+
+def genome_features(genome):
+    """
+    дешевые признаки генома для суррогатной модели:
+    ожидаемые количество пакетов и объем нагрузки (логарифмы, см. Flow.expected_packets), доли типов потоков,
+    размеры генома, доля сетей слева и средняя ширина адресного пространства
+    сетей (в битах адреса узла, как их назначает Translator), texp
+    """
+
+    packets = 0.0
+    volume = 0.0
+    kinds = {FlowICMP: 0, FlowTCP: 0, FlowUDP: 0}
+    for f in genome.flows:
+        packets += f.expected_packets()
+        volume += f.expected_bytes()
+        kinds[type(f)] += 1
+    flows = float(len(genome.flows)) or 1.0
+    nets = float(len(genome.nets)) or 1.0
+    left = sum(1 for mask, direction in genome.nets if direction == 'l')
+    host_bits = sum(32 - mask for mask, direction in genome.nets)
+    return numpy.array([1.0, math.log1p(packets), math.log1p(volume),
+                        kinds[FlowICMP] / flows, kinds[FlowTCP] / flows, kinds[FlowUDP] / flows,
+                        len(genome.flows), len(genome.nodes), len(genome.nets),
+                        left / nets, host_bits / nets, genome.texp / 100.0])
+
+
+class SurrogateModel(object):
+    """
+    гребневая регрессия оценки по признакам генома, обучаемая по мере
+    поступления реальных оценок: хранятся только X^T X и X^T y
+    ridge       - коэффициент регуляризации
+    min_samples - количество оценок, после которого модель используется
+    >>> model = SurrogateModel(ridge=1e-6, min_samples=3)
+    >>> for x in xrange(5):
+    ...     model.update(numpy.array([1.0, x]), 2.0 * x + 1)
+    >>> round(model.predict(numpy.array([1.0, 10.0])), 3)
+    21.0
+    """
+
+    def __init__(self, ridge=1.0, min_samples=8):
+        self.ridge = ridge
+        self.min_samples = min_samples
+        self.xtx = None
+        self.xty = None
+        self.samples = 0
+        self.weights = None
+
+    @property
+    def ready(self):
+        return self.samples >= self.min_samples
+
+    def update(self, features, score):
+        if self.xtx is None:
+            self.xtx = numpy.zeros((len(features), len(features)))
+            self.xty = numpy.zeros(len(features))
+        self.xtx += numpy.outer(features, features)
+        self.xty += features * score
+        self.samples += 1
+        self.weights = None
+
+    def predict(self, features):
+        if self.weights is None:
+            self.weights = numpy.linalg.solve(self.xtx + self.ridge * numpy.eye(len(self.xty)), self.xty)
+        return float(numpy.dot(self.weights, features))
+
+
+class ScreenedPool(CachedPool):
+    """
+    пул с предварительным отбором: из особей, которых нет в кэше, реально
+    (на оборудовании) оцениваются только top_k лучших по прогнозу модели,
+    остальные получают прогноз в качестве оценки, ограниченный так, что особь
+    без реальной оценки не лучше худшей реально оцененной особи поколения
+    (иначе она переживет элитизм и станет лучшей особью прогона, ни разу не
+    побывав на оборудовании) и не выходит за диапазон реальных оценок
+    (линейная модель может дать отрицательный прогноз, а масштабирование
+    pyevolve Scaling.LinearScaling отрицательных оценок не допускает); прогнозы не кэшируются,
+    поэтому выжившая особь снова участвует в отборе следующего поколения
+    до готовности модели оцениваются все особи
+    maximize - лучшими считаются особи с большей оценкой (как в GSimpleGA по умолчанию)
+    """
+
+    def __init__(self, pool, cache, model, top_k, maximize=True):
+        if top_k < 1:
+            raise ValueError(top_k)
+        super(ScreenedPool, self).__init__(pool, cache)
+        self.model = model
+        self.top_k = top_k
+        self.maximize = maximize
+        self.measured = 0
+        self.predicted = 0
+        # наименьшая и наибольшая реальные оценки
+        self.lowest = None
+        self.highest = None
+
+    def evaluate(self, func, genomes, keys, known=()):
+        features = [genome_features(g) for g in genomes]
+        if self.model.ready and len(genomes) > self.top_k:
+            predictions = [self.model.predict(x) for x in features]
+            ranked = sorted(xrange(len(genomes)), key=predictions.__getitem__, reverse=self.maximize)
+            chosen = sorted(ranked[:self.top_k])
+        else:
+            predictions = None
+            chosen = range(len(genomes))
+
+        results = super(ScreenedPool, self).evaluate(func, [genomes[i] for i in chosen], [keys[i] for i in chosen])
+        for i, score in zip(chosen, results):
+            self.model.update(features[i], score)
+            self.lowest = score if self.lowest is None else min(self.lowest, score)
+            self.highest = score if self.highest is None else max(self.highest, score)
+        if predictions is None:
+            scores = [None] * len(genomes)
+        else:
+            scores = [self.bound(p, list(results) + list(known)) for p in predictions]
+        for i, score in zip(chosen, results):
+            scores[i] = score
+        self.measured += len(chosen)
+        self.predicted += len(genomes) - len(chosen)
+        return scores
+
+    def bound(self, prediction, real):
+        """
+        оценка особи по прогнозу: не лучше худшей из реальных оценок поколения real
+        и в пределах реальных оценок прогона
+        """
+
+        if self.maximize:
+            return min(max(prediction, self.lowest), min(real))
+        return max(min(prediction, self.highest), max(real))
+
+    def stats(self):
+        return 'measured: {0}, predicted: {1}, model samples: {2}'.format(self.measured, self.predicted,
+                                                                           self.model.samples)
+
+
+def install(ga, processes=None):
+    """
+    оценка популяции ga с предварительным отбором по суррогатной модели;
+    реальная оценка - в пуле процессов (config.parallel_evaluation) или в текущем процессе
+    """
+
+    pool = process_pool(processes) if config.parallel_evaluation else SerialPool()
+    model = SurrogateModel(config.surrogate_ridge, config.surrogate_min_samples)
+    return install_pool(ga, ScreenedPool(pool, fitness_cache, model, config.surrogate_top_k,
+                                         ga.getMinimax() == Consts.minimaxType['maximize']))
@@ -1,27 +1,80 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import heapq
+import logging
+import sys
+import threading
+import time
 import uuid
+from itertools import chain, islice
 from scapy.layers.rip import RIPEntry, RIP
+import config
+from capture import Capture
+from fitness_cache import fitness_cache
 import genetic_engine
+from matcher import PacketMatcher, frame_prefix
 from nets_manager import Translator
+import parallel
+from transmitter import get_transmitter, PacedReplay
 from scapy.all import *
 
+log = logging.getLogger(__name__)
+
+
+def flow_packs(flow, index, translator, t0=0):
+    """
+    пакеты потока в порядке времени с ключом для слияния:
+    (время, индекс потока, номер пакета, сторона, пакет)
+    """
+    for number, p in enumerate(flow.generate(translator, t0)):
+        del p.chksum
+        p.src = p['IP'].src
+        p.dst = p['IP'].dst
+        yield p.time, index, number, translator.ip2pos[p['IP'].src], p
+
+
+def stream_network_packs(genome, translator=None):
+    """
+    потоковое слияние пакетов всех потоков сети в порядке времени
+    в памяти одновременно находится по одному пакету на поток
+    возвращает генератор пар (сторона, пакет)
+    """
+    if translator is None:
+        translator = Translator(genome.nets, genome.nodes)
+    streams = [flow_packs(f, i, translator) for i, f in enumerate(genome.flows)]
+    for t, index, number, side, p in heapq.merge(*streams):
+        yield side, p
+
+
+def flow_frames(flow, index, translator, t0=0):
+    """
+    пакеты потока в байтах (см. Flow.generate_raw) с ключом для слияния
+    """
+    sides = (translator.node2pos[flow.node1], translator.node2pos[flow.node2])
+    for number, (t, direction, frame) in enumerate(flow.generate_raw(translator, t0)):
+        yield t, index, number, sides[direction], frame
+
+
+def stream_network_frames(genome, translator=None):
+    """
+    потоковое слияние пакетов всех потоков сети в байтах
+    возвращает генератор (время, сторона, пакет); пакет - memoryview,
+    действительный до следующей итерации
+    """
+    if translator is None:
+        translator = Translator(genome.nets, genome.nodes)
+    streams = [flow_frames(f, i, translator) for i, f in enumerate(genome.flows)]
+    for t, index, number, side, frame in heapq.merge(*streams):
+        yield t, side, frame
+
 
 def get_network_packs(genome):
     left = []
     right = []
-    translator = Translator(genome.nets, genome.nodes)
-    for f in genome.flows:
-        packs = f.generate(translator, 0)
-        for p in packs:
-            del p.chksum
-            p.src = p['IP'].src
-            p.dst = p['IP'].dst
-        left.extend([p for p in packs if translator.ip2pos[p['IP'].src] == 'l'])
-        right.extend([p for p in packs if translator.ip2pos[p['IP'].src] == 'r'])
-
-    left.sort(key=lambda pack: pack['IP'].time)
-    right.sort(key=lambda pack: pack['IP'].time)
+    sides = {'l': left, 'r': right}
+    # пакеты приходят уже упорядоченными по времени
+    for side, p in stream_network_packs(genome):
+        sides[side].append(p)
 
     return left, right
 
@@ -29,10 +82,7 @@ def get_network_packs(genome):
 def network_packets_count_tester(genome):
     genetic_engine.check_genome(genome)
     left, right = get_network_packs(genome)
-    if len(left) > 0:
-        send(left, iface='eth1')
-    if len(right) > 0:
-        send(right, iface='eth0')
+    send_concurrently(left, right)
     name = """/home/tmp/""" + str(uuid.uuid1())
     f = open(name, 'w')
     f.write(str(genome))
@@ -44,10 +94,283 @@ def network_packets_count_tester(genome):
     return len(left) + len(right)
 
 
-def network_listener(left_count, right_count):
-    left_sniffed = sniff(iface='eth0', count=left_count)
-    right_sniffed = sniff(iface='eth1', count=right_count)
-    return left_sniffed, right_sniffed
+def run_concurrently(*tasks):
+    """
+    выполнение функций в отдельных потоках с общим стартом:
+    все потоки ждут одного события, поэтому начинают работу одновременно
+    возвращает результаты функций в порядке их передачи
+    """
+    start = threading.Event()
+    results = [None] * len(tasks)
+    errors = []
+
+    def worker(index, task):
+        start.wait()
+        try:
+            results[index] = task()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i, task)) for i, task in enumerate(tasks)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def send_concurrently(left, right):
+    """
+    одновременная отправка пакетов обеих сторон
+    """
+    tasks = []
+    if len(left) > 0:
+        tasks.append(lambda: send(left, iface=config.send_ifaces['l']))
+    if len(right) > 0:
+        tasks.append(lambda: send(right, iface=config.send_ifaces['r']))
+    run_concurrently(*tasks)
+
+
+def side_transmitters(send_ifaces=None):
+    """
+    постоянные передатчики сторон со сброшенной статистикой
+    send_ifaces - интерфейсы отправки сторон, по умолчанию из config
+    """
+    transmitters = {}
+    for side, iface in (send_ifaces or config.send_ifaces).items():
+        transmitters[side] = get_transmitter(iface)
+        transmitters[side].reset_stats()
+    return transmitters
+
+
+def network_raw_count_tester(genome):
+    """
+    отправка пакетов сети в байтах через постоянные передатчики интерфейсов
+    """
+    genetic_engine.check_genome(genome)
+    transmitters = side_transmitters()
+    for t, side, frame in stream_network_frames(genome):
+        transmitters[side].put(frame)
+    for tr in transmitters.values():
+        tr.flush()
+    return sum(tr.stats.packets for tr in transmitters.values())
+
+
+def network_paced_tester(genome):
+    """
+    отправка пакетов сети в байтах с соблюдением их меток времени
+    """
+    genetic_engine.check_genome(genome)
+    transmitters = side_transmitters()
+    replay_stats = PacedReplay(config.time_scale).replay(stream_network_frames(genome), transmitters)
+    log.debug('replay: %s', replay_stats)
+    return replay_stats.packets
+
+
+class Listener(threading.Thread):
+    """
+    захват пакетов на интерфейсе в отдельном потоке
+    сокет открывается в конструкторе, поэтому захват идет с момента создания
+    слушателя, даже если передача начнется раньше запуска потока
+    """
+
+    def __init__(self, iface, count, timeout=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.iface = iface
+        self.count = count
+        self.timeout = timeout
+        self.socket = conf.L2listen(iface=iface)
+        self.packets = None
+
+    def run(self):
+        try:
+            # при count=0 sniff ждет пакеты бесконечно
+            if not self.count:
+                self.packets = PacketList()
+                return
+            self.packets = sniff(opened_socket=self.socket, count=self.count, timeout=self.timeout)
+        finally:
+            self.socket.close()
+
+
+def start_listeners(left_count, right_count, timeout=None):
+    """
+    одновременный захват пакетов, отправленных каждой из сторон
+    """
+    listeners = (Listener(config.capture_ifaces['l'], left_count, timeout),
+                 Listener(config.capture_ifaces['r'], right_count, timeout))
+    for listener in listeners:
+        listener.start()
+    return listeners
+
+
+def join_listeners(listeners):
+    for listener in listeners:
+        listener.join()
+    return tuple(listener.packets for listener in listeners)
+
+
+def network_listener(left_count, right_count, timeout=None):
+    return join_listeners(start_listeners(left_count, right_count, timeout))
+
+
+class RawListener(threading.Thread):
+    """
+    захват кадров через Capture в отдельном потоке: в ядре отбираются
+    только кадры от сетей prefixes, сохраняются моменты их приема
+    on_frame - обработчик кадров вместо сохранения моментов приема
+    """
+
+    def __init__(self, iface, prefixes, count, timeout, on_frame=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.capture = Capture(iface, prefixes)
+        # условия остановки задаются до запуска потока, чтобы не затереть
+        # stop_after, вызванный раньше, чем поток начал захват
+        self.capture.stop_after(count, timeout)
+        self.times = []
+        self.on_frame = on_frame or (lambda t, frame: self.times.append(t))
+        self.received = 0
+
+    def run(self):
+        try:
+            self.received = self.capture.run(self.on_frame)
+        finally:
+            self.capture.close()
+
+
+def start_raw_listeners(translator, left_count, right_count, timeout, handlers=None, capture_ifaces=None):
+    """
+    одновременный захват кадров каждой из сторон без разбора scapy
+    handlers       - обработчики кадров по сторонам (см. RawListener)
+    capture_ifaces - интерфейсы захвата сторон, по умолчанию из config
+    """
+    handlers = handlers or {}
+    capture_ifaces = capture_ifaces or config.capture_ifaces
+    listeners = (RawListener(capture_ifaces['l'], translator.prefixes('l'), left_count, timeout, handlers.get('l')),
+                 RawListener(capture_ifaces['r'], translator.prefixes('r'), right_count, timeout, handlers.get('r')))
+    for listener in listeners:
+        listener.start()
+    return listeners
+
+
+def network_raw_listener(translator, left_count, right_count, timeout):
+    listeners = start_raw_listeners(translator, left_count, right_count, timeout)
+    for listener in listeners:
+        listener.join()
+    return tuple(listener.times for listener in listeners)
+
+
+def network_loss_tester(genome):
+    """
+    оценка по сопоставлению отправленных и принятых пакетов: потери,
+    нарушения порядка, дублирование и задержка (см. matcher.PacketMatcher)
+    захват идет одновременно с отправкой, пакеты сопоставляются по мере приема
+    """
+    genetic_engine.check_genome(genome)
+    translator = Translator(genome.nets, genome.nodes)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('regenerated flows: %d/%d', len(genome.dirty_flows()), len(genome.flows))
+    return transmit_and_match(translator, stream_network_frames(genome, translator))
+
+
+def network_cached_loss_tester(genome):
+    """
+    оценка по потерям через кэш оценок: геном, уже оцененный ранее
+    (например, сохраненный элитизмом), повторно не отправляется
+    """
+    return fitness_cache.evaluate(genome, network_loss_tester)
+
+
+def network_parallel_loss_tester(genome):
+    """
+    оценка по потерям в рабочем процессе пула (см. parallel): первые
+    config.prefetch_frames пакетов генерируются заранее, а устройство
+    занимается только на время отправки и захвата, поэтому генерация в
+    разных процессах идет параллельно; пакеты сверх этого количества
+    генерируются потоково во время отправки, и память процесса ограничена
+    """
+    genetic_engine.check_genome(genome)
+    translator = Translator(genome.nets, genome.nodes)
+    stream = stream_network_frames(genome, translator)
+    prefetched = [(t, side, frame.tobytes()) for t, side, frame in islice(stream, config.prefetch_frames)]
+    with parallel.device_scheduler.device() as (send_ifaces, capture_ifaces):
+        return transmit_and_match(translator, chain(prefetched, stream), send_ifaces, capture_ifaces)
+
+
+def transmit_and_match(translator, frames, send_ifaces=None, capture_ifaces=None):
+    """
+    отправка пакетов (время, сторона, пакет) с захватом и сопоставлением
+    возвращает сумму оценок сторон
+    """
+    matchers = {'l': PacketMatcher(), 'r': PacketMatcher()}
+    handlers = dict((side, matcher.on_frame) for side, matcher in matchers.items())
+    # количество пакетов заранее неизвестно, захват ограничивается после отправки
+    listeners = start_raw_listeners(translator, sys.maxint, sys.maxint, config.capture_timeout, handlers,
+                                    capture_ifaces)
+    send_matched(frames, side_transmitters(send_ifaces), matchers)
+    for listener, side in zip(listeners, ('l', 'r')):
+        listener.capture.stop_after(matchers[side].sent, config.capture_grace)
+    for listener in listeners:
+        listener.join()
+    fitness = 0.0
+    for side in ('l', 'r'):
+        stats = matchers[side].stats()
+        log.debug('%s: %s', side, stats)
+        fitness += stats.fitness(config.fitness_weights)
+    return fitness
+
+
+def send_matched(frames, transmitters, matchers):
+    """
+    отправка пакетов (время, сторона, пакет) с регистрацией в сопоставителях сторон
+    пакет регистрируется при постановке в очередь, а временем его отправки
+    считается время отправки пачки (см. Transmitter.on_flush), поэтому задержка
+    не включает ожидание в пачке, а пакет, принятый до окончания отправки
+    пачки, не считается чужим
+    передатчики общие для интерфейса, поэтому у сторон с одним интерфейсом
+    передатчик и очередь ожидающих пакетов общие
+    """
+    # пакеты (сторона, префикс), ожидающие отправки в пачке передатчика
+    pending = dict((tr, []) for tr in transmitters.values())
+
+    def flush_handler(queue):
+        def on_flush(t):
+            for side, prefix in queue:
+                matchers[side].stamp(prefix, t)
+            del queue[:]
+        return on_flush
+
+    for tr, queue in pending.items():
+        tr.on_flush = flush_handler(queue)
+    try:
+        for t, side, frame in frames:
+            prefix = frame_prefix(frame)
+            if prefix is not None:
+                matchers[side].on_sent(prefix)
+                pending[transmitters[side]].append((side, prefix))
+            transmitters[side].put(frame)
+        for tr in pending:
+            tr.flush()
+    finally:
+        # передатчики общие для всех оценок
+        for tr in pending:
+            tr.on_flush = None
+
+
+def send_and_capture(left, right, timeout=None):
+    """
+    отправка пакетов обеих сторон с захватом, запущенным до начала передачи
+    возвращает пакеты, захваченные для левой и правой стороны
+    """
+    listeners = start_listeners(len(left), len(right), timeout)
+    send_concurrently(left, right)
+    return join_listeners(listeners)
 
 
 def route_sender(nets, translator):
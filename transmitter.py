@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import time
+
+import config
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_HEADER = struct.Struct('!6s6sH')
+# размер ячейки буфера под один кадр
+FRAME_SIZE = 2048
+
+# ошибки, при которых отправку нужно повторить (очередь интерфейса заполнена)
+RETRY_ERRORS = (errno.EAGAIN, errno.ENOBUFS, errno.EINTR)
+
+
+# =============================================================================
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def load_sendmmsg():
+    """
+    системный вызов sendmmsg из libc, None если он недоступен
+    """
+
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    libc = ctypes.CDLL(name, use_errno=True)
+    sendmmsg = getattr(libc, 'sendmmsg', None)
+    if sendmmsg is not None:
+        sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+sendmmsg = load_sendmmsg()
+
+
+def mac2bytes(mac):
+    """
+    >>> mac2bytes('00:01:02:0a:0b:ff').encode('hex')
+    '0001020a0bff'
+    """
+
+    return ''.join(chr(int(b, 16)) for b in mac.split(':'))
+
+
+def iface_mac(iface):
+    """
+    MAC-адрес интерфейса, нулевой если интерфейс не найден
+    """
+
+    try:
+        with open('/sys/class/net/{0}/address'.format(iface)) as f:
+            return f.read().strip()
+    except IOError:
+        return '00:00:00:00:00:00'
+
+
+# =============================================================================
+
+
+class TransmitStats(object):
+    """
+    статистика отправки: количество кадров и байт, время от первого кадра
+    до последней отправки
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def pps(self):
+        return self.packets / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bps(self):
+        return 8 * self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return 'packets: {0}, bytes: {1}, time: {2:.3f}s, {3:.0f} pps, {4:.0f} bps'.format(
+            self.packets, self.bytes, self.elapsed, self.pps, self.bps)
+
+
+class Transmitter(object):
+    """
+    отправка готовых IP-пакетов через постоянный сокет AF_PACKET
+    кадры копируются в заранее выделенный буфер (заголовок Ethernet записан
+    в каждую ячейку один раз) и отправляются пачками по batch штук одним
+    вызовом sendmmsg, а если он недоступен - циклом send
+    sock - готовый сокет вместо сокета интерфейса (например, для тестов)
+    on_flush - обработчик отправки пачки: вызывается с временем отправки
+               после каждого flush, в котором были кадры
+    """
+
+    def __init__(self, iface, batch=None, dst_mac=None, sock=None, use_sendmmsg=True):
+        self.iface = iface
+        self.batch = batch or config.transmit_batch
+        if sock is None:
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+            sock.bind((iface, 0))
+        self.sock = sock
+        self.sendmmsg = sendmmsg if use_sendmmsg else None
+
+        eth_header = ETH_HEADER.pack(mac2bytes(dst_mac or config.dst_mac), mac2bytes(iface_mac(iface)), ETH_P_IP)
+        self.buffer = bytearray(self.batch * FRAME_SIZE)
+        self.view = memoryview(self.buffer)
+        for i in xrange(self.batch):
+            self.buffer[i * FRAME_SIZE:i * FRAME_SIZE + ETH_HEADER.size] = eth_header
+        self.lengths = [0] * self.batch
+        self.count = 0
+
+        if self.sendmmsg is not None:
+            base = ctypes.addressof(ctypes.c_char.from_buffer(self.buffer))
+            self.iovecs = (IOVec * self.batch)()
+            self.messages = (MMsgHdr * self.batch)()
+            for i in xrange(self.batch):
+                self.iovecs[i].iov_base = base + i * FRAME_SIZE
+                self.messages[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                self.messages[i].msg_hdr.msg_iovlen = 1
+
+        self.stats = TransmitStats()
+        self.on_flush = None
+
+    def reset_stats(self):
+        self.stats = TransmitStats()
+
+    def put(self, frame):
+        """
+        постановка IP-пакета в очередь отправки; пакет копируется,
+        поэтому после вызова его буфер можно переиспользовать
+        """
+
+        length = ETH_HEADER.size + len(frame)
+        if length > FRAME_SIZE:
+            raise ValueError('Frame is too long: {0}'.format(length))
+        if self.stats.started is None:
+            self.stats.started = time.time()
+        offset = self.count * FRAME_SIZE
+        self.buffer[offset + ETH_HEADER.size:offset + length] = frame
+        self.lengths[self.count] = length
+        self.count += 1
+        if self.count == self.batch:
+            self.flush()
+
+    def send(self, frames):
+        """
+        отправка всех пакетов последовательности, возвращает статистику
+        """
+
+        for frame in frames:
+            self.put(frame)
+        self.flush()
+        return self.stats
+
+    def flush(self):
+        """
+        отправка накопленных кадров
+        """
+
+        if not self.count:
+            return
+        if self.sendmmsg is not None:
+            self.__flush_sendmmsg()
+        else:
+            self.__flush_loop()
+        self.stats.packets += self.count
+        self.stats.bytes += sum(self.lengths[:self.count])
+        self.stats.finished = time.time()
+        self.count = 0
+        if self.on_flush is not None:
+            self.on_flush(self.stats.finished)
+
+    def __flush_sendmmsg(self):
+        for i in xrange(self.count):
+            self.iovecs[i].iov_len = self.lengths[i]
+        base = ctypes.addressof(self.messages)
+        fd = self.sock.fileno()
+        sent = 0
+        while sent < self.count:
+            result = self.sendmmsg(fd, base + sent * ctypes.sizeof(MMsgHdr), self.count - sent, 0)
+            if result < 0:
+                code = ctypes.get_errno()
+                if code in RETRY_ERRORS:
+                    continue
+                raise OSError(code, os.strerror(code))
+            sent += result
+
+    def __flush_loop(self):
+        for i in xrange(self.count):
+            offset = i * FRAME_SIZE
+            frame = self.view[offset:offset + self.lengths[i]]
+            while True:
+                try:
+                    self.sock.send(frame)
+                    break
+                except socket.error as e:
+                    if e.errno not in RETRY_ERRORS:
+                        raise
+
+    def close(self):
+        self.sock.close()
+
+
+# =============================================================================
+
+
+class ReplayStats(object):
+    """
+    статистика воспроизведения по меткам времени: опоздание - разница
+    между фактическим и назначенным моментом передачи пакета
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.packets = 0
+        self.late = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        # опоздание последнего пакета - накопленный дрейф
+        self.drift = 0.0
+
+    def record(self, lateness):
+        self.packets += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.drift = lateness
+        if lateness > self.tolerance:
+            self.late += 1
+
+    @property
+    def mean_lateness(self):
+        return self.total_lateness / self.packets if self.packets else 0.0
+
+    def __repr__(self):
+        return 'packets: {0}, late: {1}, mean lateness: {2:.6f}s, max lateness: {3:.6f}s, drift: {4:.6f}s'.format(
+            self.packets, self.late, self.mean_lateness, self.max_lateness, self.drift)
+
+
+class PacedReplay(object):
+    """
+    воспроизведение потока пакетов (время, сторона, пакет) с соблюдением
+    интервалов между метками времени
+    time_scale - множитель интервалов (2.0 - вдвое медленнее)
+    spin       - интервал перед назначенным моментом, который выжидается
+                 активным ожиданием вместо sleep (sleep неточен)
+    tolerance  - допустимое опоздание пакета
+    пакеты, срок которых уже наступил, копятся в пачки передатчиков,
+    пачки отправляются перед каждым ожиданием, поэтому при высокой
+    интенсивности воспроизведение не отстает от расписания
+    """
+
+    def __init__(self, time_scale=1.0, spin=0.0002, tolerance=0.001, clock=time.time, sleep=time.sleep):
+        if time_scale <= 0:
+            raise ValueError(time_scale)
+        self.time_scale = time_scale
+        self.spin = spin
+        self.tolerance = tolerance
+        self.clock = clock
+        self.sleep = sleep
+
+    def wait(self, target):
+        delay = target - self.clock()
+        if delay > self.spin:
+            self.sleep(delay - self.spin)
+        while self.clock() < target:
+            pass
+
+    def replay(self, stream, transmitters):
+        """
+        stream       - пакеты в порядке времени (см. tester.stream_network_frames)
+        transmitters - словарь передатчиков по сторонам (методы put и flush)
+        """
+
+        stats = ReplayStats(self.tolerance)
+        start = None
+        t_first = 0.0
+        for t, side, frame in stream:
+            if start is None:
+                t_first = t
+                start = self.clock()
+            target = start + (t - t_first) * self.time_scale
+            if target > self.clock():
+                for tr in transmitters.values():
+                    tr.flush()
+                self.wait(target)
+            stats.record(self.clock() - target)
+            transmitters[side].put(frame)
+        for tr in transmitters.values():
+            tr.flush()
+        return stats
+
+
+# передатчики интерфейсов, общие для всех оценок
+transmitters = {}
+
+
+def get_transmitter(iface):
+    """
+    постоянный передатчик интерфейса, сокет не закрывается между оценками
+    """
+
+    if iface not in transmitters:
+        transmitters[iface] = Transmitter(iface)
+    return transmitters[iface]
@@ -1,15 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import cPickle
+import os
+import tempfile
+import threading
+import time
 from unittest import TestCase
+from socket import inet_aton, inet_ntoa
 
 from scapy.all import *
 from scapy.layers.inet import IP, UDP, TCP, ICMP
 
-from flow import FlowUDP, FlowTCP, FlowICMP, FlowSock
+from flow import FlowUDP, FlowTCP, FlowICMP, FlowSock, payload_pool
 from fx import *
 from genetic_engine import NetworkGenome, network_initializer, translate_nodes_and_nets, delete_node, network_mutator, \
-    node_mutator
+    node_mutator, flow_mutator, fflow_mutator, texp_mutator, network_crossover, delete_nodes, delete_net, set_endpoints
 from nets_manager import Translator
+from parallel import DeviceScheduler, CachedPool
+import config
+from fitness_cache import FitnessCache, fitness_cache
+from surrogate import SurrogateModel, ScreenedPool, genome_features
+from islands import evolve_islands, full, migrant
+from population_store import PopulationStore
+from capture import Capture, address_filter, IP_SRC_OFFSET
+from matcher import PacketMatcher, frame_prefix
+from raw_packets import RawPacketBuilder, TCPTemplate, UDPTemplate, ICMPTemplate, PayloadPool
+from tester import get_network_packs, stream_network_frames, run_concurrently, Listener, network_parallel_loss_tester, \
+    send_matched
+from transmitter import Transmitter, ETH_HEADER, PacedReplay
 
 
 class TestFX(TestCase):
@@ -25,6 +43,51 @@ class TestFX(TestCase):
         assert len(counts) == 2
         assert 0.23 < float(counts[42]) / counts[9] < 0.27
 
+    def test_random_after_load(self):
+        f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
+        f.random()
+        f.load([[1.0, 77]])
+        assert all(f.random() == 77 for i in xrange(100))
+
+    def test_sample(self):
+        f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
+        s = f.sample(10000)
+        assert len(s) == 10000
+        assert set(s.tolist()) == set([9, 42])
+        assert 0.23 < float((s == 42).sum()) / (s == 9).sum() < 0.27
+        ftp = FTP([[0.5, 0.01], [1.0, 0.05]])
+        assert all(isinstance(v, float) for v in ftp.sample(10).tolist())
+
+    def test_seeded_mutation(self):
+        f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
+        g = f.clone()
+        rng1, rng2 = random.Random(7), random.Random(7)
+        for i in xrange(20):
+            f.mutation(rng1)
+            g.mutation(rng2)
+        assert f.points == g.points
+        assert [f.random(rng1) for i in xrange(10)] == [g.random(rng2) for i in xrange(10)]
+
+    def test_arrays(self):
+        f = FLP([[0.2, 420], [1.0, 900]])
+        assert not hasattr(f, '__dict__')
+        assert f.values.typecode == 'l' and FTP([[1.0, 0.05]]).values.typecode == 'd'
+        g = f.clone()
+        g.mutation_v()
+        assert f.points == [[0.2, 420], [1.0, 900]] and g.points != f.points
+        g.points = []
+        assert len(g.values) == 0 and len(f.values) == 2
+
+    def test_pickle(self):
+        f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
+        size = len(cPickle.dumps(f, 2))
+        f.sample(10)
+        # кэш выборки не передается между процессами
+        assert len(cPickle.dumps(f, 2)) == size
+        g = cPickle.loads(cPickle.dumps(f, 2))
+        assert g.points == f.points
+        assert set(g.sample(100).tolist()) == set([9, 42])
+
     def test_mutation(self):
         f = FX(1, 100, int, [[0.2, 42], [1.0, 9]])
         old_points = []
@@ -50,10 +113,18 @@ class TestFX(TestCase):
         ftp = FTP([[0, 0.075]])
         ftp2 = FTP([[1, 0.1]])
         ftp.copy(ftp2)
-        assert ftp2.points[0][1] == 0.075
-        ftp2.points[0][1] = 3
-
+        points = ftp.points
+        assert ftp2.points == points
+        # копия не разделяет с оригиналом массивы точек
+        ftp2.values[0] = 3
+        ftp2.probabilities[0] = 0.5
+        assert ftp.points == points
+        ftp2.points = [[1.0, 0.2]]
+        assert ftp.points == points
+        # points - снимок, изменение его элементов не меняет ФРВ
+        ftp.points[0][1] = 3
         assert ftp.points[0][1] == 0.075
+
         assert ftp.v_delta == ftp2.v_delta
 
     def test_clone(self):
@@ -61,6 +132,25 @@ class TestFX(TestCase):
         ftp2 = ftp.clone()
         assert isinstance(ftp2, FTP)
 
+    def test_blend(self):
+        f1 = FLP([[0.2, 100], [0.6, 500], [1.0, 1300]])
+        f2 = FLP([[0.4, 1300], [1.0, 100]])
+        f1.blend(f2, random.Random(3))
+        assert len(f1.points) == 3 and len(f2.points) == 2
+        for p, v in f1.points + f2.points:
+            assert 0.0 <= p <= 1.0 and 100 <= v <= 1300 and type(v) == int
+        assert f1.points[-1][0] == f2.points[-1][0] == 1.0
+        self.assertRaises(ValueError, f1.blend, FTP([[1.0, 0.1]]))
+
+    def test_statistics(self):
+        fx = FLP([[0.25, 100], [0.5, 300], [1.0, 100]])
+        assert fx.distribution() == [(100, 0.75), (300, 0.25)]
+        assert fx.mean() == 150.0
+        assert abs(fx.variance() - 7500.0) < 1e-9
+        assert fx.cdf(100) == 0.75 and fx.cdf(99) == 0.0 and fx.cdf(300) == 1.0
+        assert (fx.quantile(0.5), fx.quantile(0.75), fx.quantile(0.8)) == (100, 100, 300)
+        self.assertRaises(ValueError, fx.quantile, 1.5)
+
 
 class TestTranslator(TestCase):
     def test_ip_generate(self):
@@ -74,6 +164,85 @@ class TestTranslator(TestCase):
         assert pat.match(t.node2ip[1])
 
 
+class TestRawPacketBuilder(TestCase):
+    src = '10.0.0.1'
+    dst = '192.168.1.2'
+
+    def check(self, scapy_packet, frame):
+        assert str(scapy_packet) == frame.tobytes()
+
+    def test_tcp(self):
+        b = RawPacketBuilder()
+        for payload in ('', 'A', 'payload' * 100):
+            self.check(IP(src=self.src, dst=self.dst, ttl=5) /
+                       TCP(sport=1234, dport=80, seq=4000000000, ack=7, flags=1 | 16) / payload,
+                       b.tcp(inet_aton(self.src), inet_aton(self.dst), 1234, 80, 4000000000, 7, 1 | 16, 5, payload))
+
+    def test_udp(self):
+        b = RawPacketBuilder()
+        for payload in ('', 'A', 'payload' * 100):
+            self.check(IP(src=self.src, dst=self.dst, ttl=64) / UDP(sport=53, dport=40000) / payload,
+                       b.udp(inet_aton(self.src), inet_aton(self.dst), 53, 40000, 64, payload))
+
+    def test_icmp(self):
+        b = RawPacketBuilder()
+        for icmp_type in (0, 3, 5, 8, 11, 17, 40):
+            self.check(IP(src=self.src, dst=self.dst, ttl=1) / ICMP(type=icmp_type, seq=42) / 'xyz',
+                       b.icmp(inet_aton(self.src), inet_aton(self.dst), icmp_type, 42, 1, 'xyz'))
+
+    def test_templates(self):
+        b = RawPacketBuilder()
+        src, dst = inet_aton(self.src), inet_aton(self.dst)
+        tcp = TCPTemplate(src, dst, 1234, 80)
+        udp = UDPTemplate(src, dst, 53, 40000)
+        icmp = [ICMPTemplate(src, dst, icmp_type) for icmp_type in (0, 3, 8, 17)]
+        for i in xrange(200):
+            payload = 'x' * random.randint(0, 1300)
+            ttl = random.randint(0, 255)
+            seq, ack = random.randint(0, 2 ** 32 - 1), random.randint(0, 2 ** 32 - 1)
+            flags = random.choice((2, 2 | 16, 16, 1 | 16))
+            assert tcp.build(seq, ack, flags, ttl, payload).tobytes() == \
+                b.tcp(src, dst, 1234, 80, seq, ack, flags, ttl, payload).tobytes()
+            assert udp.build(ttl, payload).tobytes() == b.udp(src, dst, 53, 40000, ttl, payload).tobytes()
+            for t, icmp_type in zip(icmp, (0, 3, 8, 17)):
+                assert t.build(i, ttl, payload).tobytes() == b.icmp(src, dst, icmp_type, i, ttl, payload).tobytes()
+
+    def test_payload_pool(self):
+        pool = PayloadPool()
+        src, dst = inet_aton(self.src), inet_aton(self.dst)
+        udp = UDPTemplate(src, dst, 53, 40000)
+        prefixes = set()
+        for length in (100, 101, 1300):
+            body, prefix, body_sum = pool.take(length)
+            prefixes.add(prefix)
+            assert udp.build(64, body, prefix, body_sum).tobytes() == \
+                RawPacketBuilder().udp(src, dst, 53, 40000, 64, prefix + body.tobytes()).tobytes()
+        assert len(prefixes) == 3
+        pool_id = pool.pool_id
+        pool.reset()
+        assert pool.pool_id != pool_id
+
+    def test_flow_generate_raw(self):
+        ftp = FTP([[1.0, 0.1]])
+        flp = FLP([[0.5, 100], [1.0, 101]])
+        fttl = FTTL([[1.0, 1]])
+        ftf = FTF([[1.0, 10]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        t = Translator([(8, 'l'), (16, 'r')], [0, 1])
+        for f, layer in ((FlowUDP(9999, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf), UDP),
+                         (FlowTCP(9999, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf), TCP),
+                         (FlowICMP(8, 0, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf), ICMP)):
+            frames = 0
+            for time, direction, frame in f.generate_raw(t, 0):
+                p = IP(frame.tobytes())
+                assert p.src == t.node2ip[direction]
+                del p.chksum
+                del p[layer].chksum
+                assert str(p) == frame.tobytes()
+                frames += 1
+            assert frames > 0
+
+
 class TestFlowSock(TestCase):
     def test_copy(self):
         ftp = FTP([[1.0, 0.1]])
@@ -115,12 +284,70 @@ class TestFlowUdp(TestCase):
         nodes = [0, 1]
         t = Translator(nets, nodes)
 
-        packs = f.generate(translator=t, t0=0)
+        packs = list(f.generate(translator=t, t0=0))
         assert len(packs) > 0
         for p in packs:
             assert isinstance(p, IP)
             assert isinstance(p.payload, UDP)
 
+    def test_schedule(self):
+        ftp = FTP([[1.0, 0.1]])
+        flp = FLP([[0.5, 100], [1.0, 200]])
+        fttl = FTTL([[1.0, 1]])
+        ftf = FTF([[1.0, 100]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        f = FlowUDP(9999, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+
+        s = f.schedule(10.0)
+        assert 950 < len(s) < 1050
+        assert sum(s.counts()) == len(s)
+        assert s.times[0] == 10.0
+        assert (s.times[1:] >= s.times[:-1]).all() and s.times[-1] < 110.0
+        assert set(s.lengths.tolist()) <= set([100, 200])
+
+        t = Translator([(8, 'l'), (16, 'r')], [0, 1])
+        packs = list(f.materialize(t, s))
+        assert len(packs) == len(s)
+        assert [p.time for p in packs] == s.times.tolist()
+        assert [p[UDP].sport for p in packs] == [9999 if d == 0 else 42 for d in s.directions.tolist()]
+
+    def test_plan_cache(self):
+        ftp = FTP([[1.0, 0.1]])
+        flp = FLP([[0.5, 100], [1.0, 200]])
+        fttl = FTTL([[1.0, 1]])
+        ftf = FTF([[0.5, 10], [1.0, 20]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        for f in (FlowUDP(9999, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf),
+                  FlowTCP(9999, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf),
+                  FlowICMP(8, 0, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)):
+            assert f.dirty
+            plan = f.plan(0)
+            assert not f.dirty
+            assert f.plan(0) is plan
+            # копия использует план оригинала до первого изменения
+            clone = f.clone()
+            assert not clone.dirty and clone.plan(0) is plan
+            clone.mutation()
+            assert clone.dirty and not f.dirty
+            # план воспроизводится по зерну потока
+            f.mark_dirty()
+            t = Translator([(8, 'l'), (16, 'r')], [0, 1])
+            times = [time for time, direction, frame in f.generate_raw(t, 0)]
+            f.mark_dirty()
+            assert [time for time, direction, frame in f.generate_raw(t, 0)] == times
+            assert f.plan(5.0) is not plan
+
+    def test_expected_packets(self):
+        ftp = FTP([[1.0, 0.01]])
+        flp = FLP([[1.0, 200]])
+        fttl = FTTL([[1.0, 1]])
+        ftf = FTF([[1.0, 10]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        f = FlowUDP(1, 2, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+        packets = f.expected_packets()
+        assert 1000 <= packets <= 1002 and f.expected_bytes() == packets * payload_pool.size(200)
+        assert 950 < len(f.schedule(0, numpy.random.RandomState(1))) < 1050
+
 
 class TestFlowTCP(TestCase):
     def test_generate(self):
@@ -135,12 +362,23 @@ class TestFlowTCP(TestCase):
         nodes = [0, 1]
         t = Translator(nets, nodes)
 
-        packs = f.generate(translator=t, t0=0)
+        packs = list(f.generate(translator=t, t0=0))
         assert len(packs) > 0
         for p in packs:
             assert isinstance(p, IP)
             assert isinstance(p.payload, TCP)
 
+    def test_expected_packets(self):
+        ftp = FTP([[1.0, 0.01]])
+        flp = FLP([[1.0, 200]])
+        fttl = FTTL([[1.0, 1]])
+        ftf = FTF([[1.0, 10]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        f = FlowTCP(1, 2, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+        # сегменты данных в обоих направлениях плюс открытие и закрытие соединения
+        assert 1000 < f.expected_packets() < 1010
+        assert abs(len(f.plan(0)) - f.expected_packets()) < 50
+
 
 class TestFlowICMP(TestCase):
     def test_generate(self):
@@ -155,7 +393,7 @@ class TestFlowICMP(TestCase):
         nodes = [0, 1]
         t = Translator(nets, nodes)
 
-        packs = f.generate(translator=t, t0=0)
+        packs = list(f.generate(translator=t, t0=0))
         assert len(packs) > 0
         for p in packs:
             assert isinstance(p, IP)
@@ -202,6 +440,75 @@ class TestNetworkGenome(TestCase):
         o2.nets[1] = (16, 'l')
         assert o1.nets[1][1] == 'r'
 
+    def test_clone_validation(self):
+        g = network_initializer(None)
+        clone = g.clone()
+        assert clone.content_hash() == g.content_hash()
+        assert type(clone.flows[0]) == type(g.flows[0]) and type(clone.fflow) == FFlow
+        # испорченная особь копируется без проверки, кроме отладочного режима
+        g.nodes.append(len(g.nets))
+        g.clone()
+        config.validate_clones = True
+        try:
+            self.assertRaises(ValueError, g.clone)
+        finally:
+            config.validate_clones = False
+
+    def test_dirty_flows(self):
+        g = network_initializer(None)
+        assert g.dirty_flows() == range(len(g.flows))
+        for f in g.flows:
+            f.plan(0)
+        assert g.dirty_flows() == []
+        g.flows[-1].mutation()
+        assert g.dirty_flows() == [len(g.flows) - 1]
+        assert g.clone().dirty_flows() == [len(g.flows) - 1]
+
+    def test_seeded_evolution(self):
+        def run(seed):
+            g = network_initializer(None, rng=random.Random(seed))
+            hashes = [g.content_hash()]
+            for mutator in (flow_mutator, fflow_mutator, texp_mutator, flow_mutator):
+                g = g.clone()
+                mutator(g)
+                hashes.append(g.content_hash())
+            sister, brother = network_crossover(None, mom=g, dad=g.clone())
+            return hashes + [sister.content_hash(), brother.content_hash()]
+
+        assert run(1) == run(1)
+        assert run(1) != run(2)
+
+    def test_crossover_operators(self):
+        mom = network_initializer(None, rng=random.Random(11))
+        dad = network_initializer(None, rng=random.Random(12))
+        flows = sorted(f.canonical()[3:4] for f in mom.flows + dad.flows)
+        try:
+            for kind in ('one_point', 'two_point', 'uniform'):
+                config.crossover = kind
+                sister, brother = network_crossover(None, mom=mom, dad=dad)
+                # потоки распределяются между потомками без потерь и повторов
+                assert sorted(f.canonical()[3:4] for f in sister.flows + brother.flows) == flows
+                # неиспользуемых сетей и узлов у потомков нет
+                for child in (sister, brother):
+                    assert set(child.nodes) == set(xrange(len(child.nets)))
+            config.crossover_blend = True
+            sister, brother = network_crossover(None, mom=mom, dad=dad)
+            assert sister.fflow.canonical() != mom.fflow.canonical()
+            assert sister.dirty_flows() == range(len(sister.flows))
+        finally:
+            config.crossover = 'one_point'
+            config.crossover_blend = False
+
+    def test_content_hash(self):
+        g = network_initializer(None)
+        clone = g.clone()
+        assert clone.content_hash() == g.content_hash()
+        clone.texp += 1.0
+        assert clone.content_hash() != g.content_hash()
+        clone = g.clone()
+        clone.flows[0].fxs[0].load([[1.0, 0.05]])
+        assert clone.content_hash() != g.content_hash()
+
     def test_network_initializer(self):
         net = network_initializer(None)
         assert isinstance(net, NetworkGenome)
@@ -223,10 +530,22 @@ class TestNetworkGenome(TestCase):
         nodes = [0, 1]
         s_nets = [('a', 'l'), ('a', 'l')]
         b_nets = [('b', 'r'), ('b', 'r')]
-        res_nets, res_nodes = translate_nodes_and_nets(flows, nodes, nodes, s_nets, b_nets,
-                                                       lambda x: 's' if x < 2 else 'b')
+        res_nets, res_nodes, endpoints = translate_nodes_and_nets(flows, nodes, nodes, s_nets, b_nets,
+                                                                  lambda x: 's' if x < 2 else 'b')
         assert len(res_nets) == 4
         assert len(res_nodes) == 4
+        assert endpoints == [(0, 1), (1, 0), (2, 3), (3, 2)]
+        # потоки не изменяются
+        assert [(f.node1, f.node2) for f in flows] == [(0, 1), (1, 0), (0, 1), (1, 0)]
+
+    def test_crossover_copies(self):
+        mom = network_initializer(None, rng=random.Random(7))
+        dad = network_initializer(None, rng=random.Random(8))
+        mom_hash, dad_hash = mom.content_hash(), dad.content_hash()
+        sister, brother = network_crossover(None, mom=mom, dad=dad)
+        assert (mom.content_hash(), dad.content_hash()) == (mom_hash, dad_hash)
+        assert not set(map(id, sister.flows)) & set(map(id, brother.flows))
+        assert len(sister.flows) + len(brother.flows) == len(mom.flows) + len(dad.flows)
 
     def test_delete_node(self):
         fflow = FFlow([[0.1, 1], [0.3, 2], [0.5, 3], [1.0, 4]])
@@ -246,9 +565,27 @@ class TestNetworkGenome(TestCase):
         o1 = NetworkGenome(nets, nodes, flows, fflow, 42.0)
         delete_node(o1, 2)
         assert len(o1.nodes) == 3
-        # assert len(o1.nets) == 2
+        assert len(o1.nets) == 2
         assert len(o1.flows) == 1
 
+    def test_delete_nodes(self):
+        g = network_initializer(None, rng=random.Random(3))
+        expected = g.clone()
+        for index in sorted([0, len(g.nodes) - 1], reverse=True):
+            delete_node(expected, index)
+        delete_nodes(g, [0, len(g.nodes) - 1])
+        assert g.content_hash() == expected.content_hash()
+
+    def test_delete_net(self):
+        g = network_initializer(None, rng=random.Random(5))
+        nets = g.nets[:]
+        used = [i for i, net in enumerate(g.nodes) if net != 0]
+        flows = [f.canonical()[3:] for f in g.flows if f.node1 in used and f.node2 in used]
+        delete_net(g, 0)
+        assert g.nets == nets[1:]
+        assert len(g.nodes) == len(used)
+        assert [f.canonical()[3:] for f in g.flows] == flows
+
     def test_network_mutator(self):
         fflow = FFlow([[0.1, 1], [0.3, 2], [0.5, 3], [1.0, 4]])
         ftp = FTP([[0.1, 0.010], [0.2, 0.020], [0.8, 0.040], [1.0, 0.060]])
@@ -289,3 +626,502 @@ class TestNetworkGenome(TestCase):
         node_mutator(o1)
         assert len(o1.nodes) != 4 or any(old_nodes[i] != o1.nodes[i] for i in xrange(4))
 
+
+class TestPopulationStore(TestCase):
+    def setUp(self):
+        self.genomes = [network_initializer(None, rng=random.Random(seed)) for seed in xrange(10)]
+        self.store = PopulationStore.pack(self.genomes)
+
+    def test_pack(self):
+        assert len(self.store) == 10
+        assert [g.content_hash() for g in self.store.genomes()] == [g.content_hash() for g in self.genomes]
+
+    def test_global_random(self):
+        # геном с явным генератором не использует модуль random
+        state = random.getstate()
+        genome = network_initializer(None, rng=random.Random(42))
+        copy = PopulationStore.pack([genome]).genome(0)
+        assert copy.content_hash() == genome.content_hash()
+        assert random.getstate() == state
+
+    def test_take(self):
+        clones = self.store.take([3, 3, 0])
+        assert [g.content_hash() for g in clones.genomes()] == [self.genomes[i].content_hash() for i in (3, 3, 0)]
+        both = PopulationStore.concat([clones, self.store])
+        assert both.genome(3).content_hash() == self.genomes[0].content_hash()
+
+    def test_crossover(self):
+        mom, dad = self.genomes[1].clone(), self.genomes[2].clone()
+        flows = mom.flows[:1] + dad.flows[1:]
+        nets, nodes, endpoints = translate_nodes_and_nets(flows, mom.nodes, dad.nodes, mom.nets, dad.nets,
+                                                          lambda x: 's' if x < 1 else 'b')
+        set_endpoints(flows, endpoints)
+        child = self.store.crossover(1, 2, 1).genome(0)
+        assert (child.nets, child.nodes) == (nets, nodes)
+        assert [f.canonical() for f in child.flows] == [f.canonical() for f in flows]
+
+
+def flows_count_evaluator(genome):
+    return float(len(genome.flows))
+
+
+def cached_flows_count_evaluator(genome):
+    return fitness_cache.evaluate(genome, flows_count_evaluator)
+
+
+class TestIslands(TestCase):
+    def test_evolve_islands(self):
+        saved = config.generations, config.population_size, config.migration_interval
+        config.generations, config.population_size, config.migration_interval = 4, 4, 1
+        try:
+            best = evolve_islands(3, 'full', seed=1, evaluator=flows_count_evaluator)
+        finally:
+            config.generations, config.population_size, config.migration_interval = saved
+        assert len(best) == 3
+        assert all(isinstance(g, NetworkGenome) and g.score == len(g.flows) for g in best)
+        assert full(0, 1) == []
+
+    def test_cache_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), 'fitness.cache')
+        saved = fitness_cache.path, fitness_cache.entries.copy(), config.generations, config.population_size
+        fitness_cache.path, config.generations, config.population_size = path, 2, 4
+        try:
+            best = evolve_islands(2, 'ring', seed=1, evaluator=cached_flows_count_evaluator)
+            # в файл попадают записи всех островов, сохраненные родителем
+            stored = FitnessCache(1000, path=path)
+            assert all(stored.get(g.content_hash()) == g.score for g in best)
+        finally:
+            fitness_cache.path, fitness_cache.entries, config.generations, config.population_size = saved
+        os.remove(path)
+
+    def test_migrant(self):
+        genome = network_initializer(None, rng=random.Random(5))
+        genome.score = 3.0
+        copy = migrant(genome)
+        assert copy is not genome and copy.score == 3.0
+        assert copy.flows[0] is not genome.flows[0] and copy.content_hash() == genome.content_hash()
+
+
+class TestNetworkPacks(TestCase):
+    @staticmethod
+    def genome():
+        fflow = FFlow([[0.1, 1], [0.3, 2], [0.5, 3], [1.0, 4]])
+        ftp = FTP([[0.1, 0.01], [0.2, 0.02], [0.8, 0.04], [1.0, 0.06]])
+        flp = FLP([[0.1, 110], [0.3, 220], [0.5, 330], [1.0, 440]])
+        fttl = FTTL([[0.1, 0], [0.3, 5], [0.5, 15], [1.0, 25]])
+        ftf = FTF([[0.2, 1], [0.3, 2], [0.6, 3], [1.0, 4]])
+        fhf = FHF([[0.5, 0], [1.0, 1]])
+        f1 = FlowUDP(9995, 42, 0, 1, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+        f2 = FlowICMP(8, 0, 0, 2, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+        f3 = FlowTCP(123, 456, 1, 2, ftp, flp, fttl, ftp, flp, fttl, ftf, fhf)
+        nets = [(8, 'l'), (16, 'r'), (8, 'r')]
+        nodes = [0, 1, 2]
+        return NetworkGenome(nets, nodes, [f1, f2, f3], fflow, 42.0)
+
+    def test_get_network_packs(self):
+        genome = self.genome()
+        t = Translator(genome.nets, genome.nodes)
+        left, right = get_network_packs(genome)
+        assert len(left) > 0 and len(right) > 0
+        for side, packs in (('l', left), ('r', right)):
+            times = [p.time for p in packs]
+            assert times == sorted(times)
+            assert all(t.ip2pos[p['IP'].src] == side for p in packs)
+
+    def test_stream_network_frames(self):
+        genome = self.genome()
+        t = Translator(genome.nets, genome.nodes)
+        times = []
+        for time, side, frame in stream_network_frames(genome, t):
+            assert t.ip2pos[IP(frame.tobytes()).src] == side
+            times.append(time)
+        assert len(times) > 0
+        assert times == sorted(times)
+
+
+class TestTransmitter(TestCase):
+    frames = ['frame{0:04d}'.format(i) * (i % 50 + 1) for i in xrange(100)]
+
+    def check(self, use_sendmmsg):
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        tr = Transmitter('lo', batch=16, sock=sender, use_sendmmsg=use_sendmmsg)
+        stats = tr.send(self.frames)
+        assert stats.packets == len(self.frames)
+        assert stats.bytes == sum(ETH_HEADER.size + len(f) for f in self.frames)
+        for f in self.frames:
+            assert receiver.recv(4096)[ETH_HEADER.size:] == f
+        sender.close()
+        receiver.close()
+
+    def test_sendmmsg(self):
+        self.check(True)
+
+    def test_send_loop(self):
+        self.check(False)
+
+    def test_on_flush(self):
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        tr = Transmitter('lo', batch=16, sock=sender)
+        flushed = []
+        tr.on_flush = lambda t: flushed.append((t, tr.stats.packets))
+        tr.send(self.frames[:40])
+        # обработчик вызывается после отправки каждой пачки
+        assert [packets for t, packets in flushed] == [16, 32, 40]
+        assert flushed[-1][0] == tr.stats.finished
+        tr.flush()
+        assert len(flushed) == 3
+        sender.close()
+        receiver.close()
+
+    def test_loopback(self):
+        try:
+            receiver = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0800))
+            receiver.bind(('lo', 0))
+            tr = Transmitter('lo', batch=16)
+        except socket.error:
+            self.skipTest('raw sockets are not permitted')
+        receiver.settimeout(1)
+        payload = 'transmitter-test'
+        frame = str(IP(src='127.0.0.1', dst='127.0.0.1') / UDP(sport=1, dport=2) / payload)
+        assert tr.send([frame] * 40).packets == 40
+        received = 0
+        try:
+            while received < 40:
+                if receiver.recv(4096).endswith(payload):
+                    received += 1
+        except socket.timeout:
+            pass
+        assert received >= 40
+        tr.close()
+        receiver.close()
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        self.now += 0.00001
+        return self.now
+
+    def sleep(self, delay):
+        self.now += delay
+
+
+class FakeTransmitter(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.queued = []
+        self.sent = []
+
+    def put(self, frame):
+        self.queued.append(frame)
+
+    def flush(self):
+        self.sent.extend((self.clock.now, f) for f in self.queued)
+        self.queued = []
+
+
+class TestPacedReplay(TestCase):
+    def test_replay(self):
+        clock = FakeClock()
+        transmitters = {'l': FakeTransmitter(clock), 'r': FakeTransmitter(clock)}
+        stream = [(10.0, 'l', 'a'), (10.5, 'r', 'b'), (10.5, 'l', 'c'), (12.0, 'l', 'd')]
+        start = clock.now
+        stats = PacedReplay(time_scale=2.0, clock=clock.time, sleep=clock.sleep).replay(stream, transmitters)
+        assert stats.packets == 4
+        assert stats.late == 0
+        assert [f for t, f in transmitters['l'].sent] == ['a', 'c', 'd']
+        assert [f for t, f in transmitters['r'].sent] == ['b']
+        # интервалы увеличены вдвое
+        sent = dict((f, t - start) for tr in transmitters.values() for t, f in tr.sent)
+        assert 0.99 < sent['b'] - sent['a'] < 1.01
+        assert 3.99 < sent['d'] - sent['a'] < 4.01
+
+    def test_lateness(self):
+        clock = FakeClock()
+        transmitters = {'l': FakeTransmitter(clock)}
+
+        def slow_stream():
+            for i in xrange(5):
+                yield i * 0.01, 'l', str(i)
+                clock.sleep(0.1)
+
+        stats = PacedReplay(clock=clock.time, sleep=clock.sleep).replay(slow_stream(), transmitters)
+        assert stats.packets == 5
+        assert stats.late == 4
+        assert stats.drift > 0.3
+
+
+class TestConcurrentTransmit(TestCase):
+    def test_run_concurrently(self):
+        started = []
+        both = threading.Event()
+
+        def task(name):
+            started.append(name)
+            if len(started) == 2:
+                both.set()
+            # при последовательном выполнении первая задача не дождется второй
+            assert both.wait(5)
+            return name
+
+        assert run_concurrently(lambda: task('l'), lambda: task('r')) == ['l', 'r']
+        assert sorted(started) == ['l', 'r']
+
+    def test_run_concurrently_error(self):
+        def fail():
+            raise ValueError('boom')
+
+        self.assertRaises(ValueError, run_concurrently, fail, lambda: 1)
+
+    def test_listener(self):
+        try:
+            listener = Listener('lo', 10, timeout=5)
+            tr = Transmitter('lo', batch=4)
+        except socket.error:
+            self.skipTest('raw sockets are not permitted')
+        # сокет захвата уже открыт, поэтому пакеты до запуска потока не теряются
+        frame = str(IP(src='127.0.0.1', dst='127.0.0.1') / UDP(sport=1, dport=2) / 'listener-test')
+        tr.send([frame] * 10)
+        listener.start()
+        listener.join()
+        assert len(listener.packets) == 10
+        tr.close()
+
+
+class TestCapture(TestCase):
+    def test_address_filter(self):
+        program = address_filter([(0x7f000000, 8)])
+        assert len(program) == 11
+        self.assertRaises(ValueError, address_filter, [(0, 32)] * 2000)
+
+    def test_capture(self):
+        try:
+            capture = Capture('lo', [(0x7f000000, 8)])
+            tr = Transmitter('lo', batch=4)
+        except socket.error:
+            self.skipTest('raw sockets are not permitted')
+        ours = str(IP(src='127.0.0.2', dst='127.0.0.1') / UDP(sport=1, dport=2) / 'capture-test')
+        foreign = str(IP(src='10.0.0.1', dst='127.0.0.1') / UDP(sport=1, dport=2) / 'capture-test')
+        tr.send([ours, foreign] * 10)
+        frames = []
+        start = time.time()
+        # кадров меньше запрошенного - захват завершается по таймауту
+        received = capture.capture(100, 0.5, lambda t, frame: frames.append((t, frame.tobytes())))
+        assert time.time() - start >= 0.5
+        # исходящие копии кадров и кадры чужих сетей отброшены фильтром
+        assert received == 10
+        assert all(IP(frame[14:]).src == '127.0.0.2' for t, frame in frames)
+        capture.close()
+        tr.close()
+
+
+class LoopbackSocket(object):
+    """
+    сокет, доставляющий кадр сопоставителю стороны отправителя еще до
+    возврата из send, то есть до окончания отправки пачки
+    """
+
+    def __init__(self, translator, matchers):
+        self.translator = translator
+        self.matchers = matchers
+
+    def send(self, frame):
+        frame = frame.tobytes()
+        side = self.translator.ip2pos[inet_ntoa(frame[IP_SRC_OFFSET:IP_SRC_OFFSET + 4])]
+        self.matchers[side].on_frame(time.time(), frame)
+
+
+class TestPacketMatcher(TestCase):
+    def test_frame_prefix(self):
+        pool = PayloadPool()
+        src, dst = inet_aton('10.0.0.1'), inet_aton('192.168.1.2')
+        templates = (lambda body, prefix, body_sum: TCPTemplate(src, dst, 1, 2).build(1, 2, 16, 64, body, prefix,
+                                                                                      body_sum),
+                     lambda body, prefix, body_sum: UDPTemplate(src, dst, 1, 2).build(64, body, prefix, body_sum),
+                     lambda body, prefix, body_sum: ICMPTemplate(src, dst, 13).build(1, 64, body, prefix, body_sum))
+        for build in templates:
+            body, prefix, body_sum = pool.take(200)
+            frame = build(body, prefix, body_sum)
+            assert frame_prefix(frame) == prefix
+            assert frame_prefix(ETH_HEADER.pack('\0' * 6, '\0' * 6, 0x0800) + frame.tobytes(), 14) == prefix
+        # пакет без нагрузки
+        assert frame_prefix(str(IP() / TCP())) is None
+
+    def test_matching(self):
+        m = PacketMatcher()
+        for i in xrange(100):
+            m.on_sent(str(i), i)
+        for i in range(50) + [60, 55, 55] + range(70, 100):
+            m.on_received(str(i), i + 0.5)
+        m.on_received('foreign', 1.0)
+        s = m.stats()
+        assert (s.sent, s.received, s.lost, s.duplicates, s.reordered, s.unknown) == (100, 84, 18, 1, 1, 1)
+        assert s.mean_latency == 0.5
+        assert s.metrics()['loss'] == 0.18
+        assert s.fitness({'loss': 1.0}) == 0.18
+
+    def test_receive_before_flush(self):
+        genome = TestNetworkPacks.genome()
+        translator = Translator(genome.nets, genome.nodes)
+        matchers = {'l': PacketMatcher(), 'r': PacketMatcher()}
+        # обе стороны на одном интерфейсе: передатчик общий
+        tr = Transmitter('lo', batch=16, sock=LoopbackSocket(translator, matchers), use_sendmmsg=False)
+        send_matched(stream_network_frames(genome, translator), {'l': tr, 'r': tr}, matchers)
+        assert tr.on_flush is None
+        for side in ('l', 'r'):
+            s = matchers[side].stats()
+            assert s.sent > 0 and (s.lost, s.unknown) == (0, 0)
+            assert s.latency_max >= 0.0
+
+
+class TestDeviceScheduler(TestCase):
+    def test_device(self):
+        pairs = [({'l': 'a1', 'r': 'a2'}, {'l': 'a2', 'r': 'a1'}), ({'l': 'b1', 'r': 'b2'}, {'l': 'b2', 'r': 'b1'})]
+        scheduler = DeviceScheduler(pairs)
+        with scheduler.device() as (send_ifaces, capture_ifaces):
+            assert send_ifaces['l'] == 'a1'
+            # пара занята до выхода из блока
+            assert not scheduler.locks[0].acquire(False)
+        assert [scheduler.assign_slot() for i in xrange(3)] == [0, 1, 0]
+        self.assertRaises(ValueError, DeviceScheduler, [])
+
+
+class FakeGenome(object):
+    def __init__(self, key):
+        self.key = key
+
+    def content_hash(self):
+        return self.key
+
+
+class FakePool(object):
+    def __init__(self):
+        self.evaluated = []
+
+    def map(self, func, genomes, chunksize=None):
+        self.evaluated += genomes
+        return [func(g) for g in genomes]
+
+
+class TestFitnessCache(TestCase):
+    def test_lru(self):
+        cache = FitnessCache(2)
+        cache.put('a', 1.0)
+        cache.put('b', 2.0)
+        cache.get('a')
+        cache.put('c', 3.0)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1.0 and cache.get('c') == 3.0
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_ttl(self):
+        now = [0.0]
+        cache = FitnessCache(10, ttl=5.0, clock=lambda: now[0])
+        cache.put('a', 1.0)
+        now[0] = 4.0
+        assert cache.get('a') == 1.0
+        now[0] = 6.0
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_evaluate(self):
+        cache = FitnessCache(10)
+        calls = []
+        evaluator = lambda g: calls.append(g) or 7.0
+        g = network_initializer(None)
+        assert cache.evaluate(g, evaluator) == 7.0
+        assert cache.evaluate(g.clone(), evaluator) == 7.0
+        assert len(calls) == 1
+
+    def test_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), 'fitness.cache')
+        cache = FitnessCache(10, path=path, save_every=2)
+        cache.put('a', 1.0)
+        # файл переписывается раз в save_every записей
+        assert not os.path.exists(path)
+        cache.put('b', 2.0)
+        cache.put('c', 3.0)
+        assert FitnessCache(10, path=path).get('b') == 2.0
+        assert FitnessCache(10, path=path).get('c') is None
+        cache.flush()
+        assert FitnessCache(10, path=path).get('c') == 3.0
+        os.remove(path)
+
+    def test_merge(self):
+        now = [2.0]
+        cache = FitnessCache(3, clock=lambda: now[0])
+        cache.put('a', 1.0)
+        now[0] = 0.0
+        cache.put('b', 2.0)
+        cache.merge([('a', (5.0, 1.0)), ('b', (7.0, 1.0)), ('c', (3.0, 1.0))])
+        # из двух записей одного генома остается более поздняя
+        assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1.0, 7.0, 3.0)
+        cache.merge([('d', (4.0, 1.0))])
+        assert len(cache) == 3 and cache.get('a') is None
+
+    def test_cached_pool(self):
+        fake = FakePool()
+        pool = CachedPool(fake, FitnessCache(10))
+        genomes = [FakeGenome('a'), FakeGenome('b')]
+        assert pool.map(lambda g: ord(g.key), genomes) == [97, 98]
+        assert pool.map(lambda g: ord(g.key), genomes + [FakeGenome('c')]) == [97, 98, 99]
+        assert [g.key for g in fake.evaluated] == ['a', 'b', 'c']
+
+
+class TestSurrogate(TestCase):
+    def test_screened_pool(self):
+        genomes = [network_initializer(None, rng=random.Random(seed)) for seed in xrange(12)]
+        assert len(genome_features(genomes[0])) == 12
+        fake = FakePool()
+        cache = FitnessCache(100)
+        pool = ScreenedPool(fake, cache, SurrogateModel(min_samples=6), top_k=2)
+        evaluate = lambda g: float(len(g.flows))
+        assert pool.map(evaluate, genomes[:6]) == [evaluate(g) for g in genomes[:6]]
+        scores = pool.map(evaluate, genomes[6:])
+        assert len(fake.evaluated) == 8 and len(scores) == 6
+        # в кэш попадают только реальные оценки
+        assert len(cache) == 8
+        assert (pool.measured, pool.predicted) == (8, 4)
+
+    def test_negative_prediction(self):
+        genomes = [network_initializer(None, rng=random.Random(seed)) for seed in xrange(4)]
+        model = SurrogateModel(min_samples=0)
+        # прогноз ниже наименьшей реальной оценки, в том числе отрицательный
+        model.predict = lambda features: -5.0
+        pool = ScreenedPool(FakePool(), FitnessCache(100), model, top_k=2)
+        scores = pool.map(lambda g: 3.0 + len(g.flows), genomes)
+        assert min(scores) >= 0.0
+        assert sorted(scores)[:2] == [pool.lowest] * 2
+
+    def test_predictions_below_measured(self):
+        genomes = [network_initializer(None, rng=random.Random(seed)) for seed in xrange(6)]
+        for maximize, prediction, cached in ((True, 100.0, 0.5), (False, -100.0, 50.0)):
+            model = SurrogateModel(min_samples=0)
+            model.predict = lambda features: prediction
+            cache = FitnessCache(100)
+            # одна особь поколения уже оценена ранее
+            cache.put(genomes[0].content_hash(), cached)
+            fake = FakePool()
+            pool = ScreenedPool(fake, cache, model, top_k=2, maximize=maximize)
+            scores = pool.map(lambda g: 1.0 + len(g.flows), genomes)
+            real = [i for i, g in enumerate(genomes) if i == 0 or any(g is e for e in fake.evaluated)]
+            measured = [scores[i] for i in real]
+            predicted = [s for i, s in enumerate(scores) if i not in real]
+            assert len(measured) == 3 and len(predicted) == 3
+            # особь без реальной оценки не лучше реально оцененных
+            if maximize:
+                assert max(predicted) <= min(measured)
+            else:
+                assert min(predicted) >= max(measured)
+
+    def test_single_cache_layer(self):
+        saved = config.surrogate_top_k
+        config.surrogate_top_k = 2
+        try:
+            genome = network_initializer(None)
+        finally:
+            config.surrogate_top_k = saved
+        # кэш проверяет пул, оценка особи идет мимо кэша
+        assert genome.evaluator[0] is network_parallel_loss_tester